@@ -34,6 +34,7 @@ _setup_path()
 from _helpers import (
     MAX_MEAN_FD,
     MIN_USABLE_VOLUMES,
+    confounds_columns,
     derivatives_connectivity,
     derivatives_fmriprep,
     eligible_subjects,
@@ -41,35 +42,53 @@ from _helpers import (
 )
 
 
+def _float_or_nan(value) -> float:
+    """Parse a confounds TSV cell, mapping fMRIPrep's "n/a" to NaN."""
+    try:
+        return float(value)
+    except ValueError:
+        return np.nan
+
+
 def _compute_run_qc(confounds_path: Path) -> dict:
     """Compute QC metrics for a single run from its confounds TSV.
 
     Returns a dict with: mean_fd, total_volumes, usable_volumes, n_cosines,
     n_motion_outliers.
     """
-    df = pd.read_csv(confounds_path, sep="\t")
+    # Only FD and the non-steady-state indicators need their values; the
+    # other counts come from the header.  Parse just those columns straight
+    # into a float array ("n/a" -> NaN) without building a DataFrame.
+    columns = confounds_columns(confounds_path)
+    usecols = [columns.index("framewise_displacement")] + [
+        i for i, c in enumerate(columns) if c.startswith("non_steady_state_outlier")
+    ]
+    values = np.loadtxt(
+        confounds_path,
+        delimiter="\t",
+        skiprows=1,
+        usecols=usecols,
+        converters={i: _float_or_nan for i in usecols},
+        ndmin=2,
+    )
 
     # Mean framewise displacement (first volume is NaN)
-    fd = df["framewise_displacement"]
-    mean_fd = float(fd.mean(skipna=True)) if not fd.isna().all() else np.nan
+    fd = values[:, 0]
+    mean_fd = float(np.nanmean(fd)) if not np.isnan(fd).all() else np.nan
 
-    total_volumes = len(df)
+    total_volumes = values.shape[0]
 
     # Count non-steady-state outlier columns
-    nss_cols = [c for c in df.columns if c.startswith("non_steady_state_outlier")]
-    n_nss = 0
-    for c in nss_cols:
-        n_nss += int(df[c].sum())
+    n_nss = int(values[:, 1:].sum())
 
     # Count motion outlier columns
-    mo_cols = [c for c in df.columns if c.startswith("motion_outlier")]
-    n_motion_outliers = len(mo_cols)
+    n_motion_outliers = sum(1 for c in columns if c.startswith("motion_outlier"))
 
     # Usable volumes = total - non-steady-state - motion outliers
     usable_volumes = total_volumes - n_nss - n_motion_outliers
 
     # Count cosine regressors (for reference)
-    n_cosines = sum(1 for c in df.columns if c.startswith("cosine"))
+    n_cosines = sum(1 for c in columns if c.startswith("cosine"))
 
     return {
         "mean_fd": round(mean_fd, 6) if not np.isnan(mean_fd) else np.nan,
@@ -82,7 +101,7 @@ def _compute_run_qc(confounds_path: Path) -> dict:
 
 def prescreen(project_root: Path) -> pd.DataFrame:
     """Run pre-screen QC on all eligible subjects."""
-    subjects = eligible_subjects(project_root)
+    subjects = eligible_subjects(project_root, columns=["source_dataset", "source_site"])
     fmriprep_dir = derivatives_fmriprep(project_root)
 
     records = []
@@ -20,17 +20,14 @@ Reads the selected run from qc_prescreen.tsv if --run is not specified.
 from __future__ import annotations
 
 import argparse
-import json
 import sys
 from datetime import datetime, timezone
 from pathlib import Path
 
-import h5py
 import nibabel as nib
 import numpy as np
 import pandas as pd
-from nilearn.datasets import fetch_atlas_msdl
-from nilearn.image import clean_img, resample_to_img
+from nilearn.image import clean_img, get_data
 from nilearn.interfaces.fmriprep import load_confounds
 from nilearn.maskers import NiftiMapsMasker
 from nilearn.signal import clean, high_variance_confounds
@@ -53,15 +50,28 @@ from _helpers import (
     MIN_ATLAS_COVERAGE,
     N_MSDL_REGIONS,
     SPACE,
-    bep017_stem,
     bold_path_from_confounds,
     brain_mask_from_confounds,
+    compute_atlas_coverage,
+    confounds_columns,
+    current_sidecar,
+    decompressed_nifti,
     derivatives_connectivity,
     derivatives_fmriprep,
+    extraction_params,
     find_confounds,
     get_tr,
+    input_fingerprint,
+    load_msdl_atlas,
+    load_qc_prescreen,
+    msdl_atlas_on_grid,
     output_dir,
+    timeseries_outputs,
     software_versions,
+    write_coverage_tsv,
+    write_relmat_h5,
+    write_sidecar_json,
+    write_timeseries_parquet,
 )
 
 #: Extraction variant descriptions (for sidecar metadata).
@@ -72,30 +82,14 @@ VARIANT_DESCRIPTIONS = {
 }
 
 
-def compute_atlas_coverage(mask_path: Path, atlas_maps_img) -> np.ndarray:
-    """Compute per-region coverage of BOLD mask over MSDL atlas."""
-    mask_img = nib.load(str(mask_path))
-    atlas_resampled = resample_to_img(
-        atlas_maps_img, mask_img, interpolation="continuous"
-    )
-    atlas_data = atlas_resampled.get_fdata()
-    mask_data = mask_img.get_fdata().astype(bool)
-
-    coverage = np.zeros(N_MSDL_REGIONS)
-    for i in range(N_MSDL_REGIONS):
-        region_map = atlas_data[..., i]
-        total_weight = np.abs(region_map).sum()
-        if total_weight > 0:
-            coverage[i] = np.abs(region_map[mask_data]).sum() / total_weight
-    return coverage
-
-
 # --------------------------------------------------------------------------- #
 # Extraction variants
 # --------------------------------------------------------------------------- #
+# ``bold`` is the original fMRIPrep path (load_confounds uses it to find the
+# confounds TSV); voxel data are read from the already-loaded ``bold_img``.
 
 
-def _extract_v1(bold, mask, conf_path, tr, atlas, masker):
+def _extract_v1(bold, bold_img, mask_img, conf_path, tr, atlas_maps, masker):
     """v1: Single-stage ROI-level confound regression."""
     confounds, sample_mask = load_confounds(
         str(bold),
@@ -105,8 +99,8 @@ def _extract_v1(bold, mask, conf_path, tr, atlas, masker):
         n_compcor=CONFOUND_N_COMPCOR,
         demean=True,
     )
-    timeseries = masker.fit_transform(
-        str(bold), confounds=confounds, sample_mask=sample_mask
+    timeseries = masker.transform(
+        bold_img, confounds=confounds, sample_mask=sample_mask
     )
     sidecar_extra = {
         "ConfoundStrategy": VARIANT_DESCRIPTIONS["v1"],
@@ -115,7 +109,7 @@ def _extract_v1(bold, mask, conf_path, tr, atlas, masker):
     return timeseries, sidecar_extra
 
 
-def _extract_v2(bold, mask, conf_path, tr, atlas, masker):
+def _extract_v2(bold, bold_img, mask_img, conf_path, tr, atlas_maps, masker):
     """v2: v1 + high-variance voxel confounds."""
     confounds, sample_mask = load_confounds(
         str(bold),
@@ -127,10 +121,8 @@ def _extract_v2(bold, mask, conf_path, tr, atlas, masker):
     )
 
     # Compute high-variance voxel PCs
-    bold_img = nib.load(str(bold))
-    mask_img = nib.load(str(mask))
-    bold_data = bold_img.get_fdata()
-    mask_data = mask_img.get_fdata().astype(bool)
+    bold_data = get_data(bold_img)
+    mask_data = get_data(mask_img).astype(bool)
     voxel_ts = bold_data[mask_data].T
     if sample_mask is not None:
         voxel_ts = voxel_ts[sample_mask]
@@ -144,8 +136,8 @@ def _extract_v2(bold, mask, conf_path, tr, atlas, masker):
     confounds_combined = pd.concat([confounds, hv_df], axis=1)
     del bold_data, voxel_ts
 
-    timeseries = masker.fit_transform(
-        str(bold), confounds=confounds_combined, sample_mask=sample_mask
+    timeseries = masker.transform(
+        bold_img, confounds=confounds_combined, sample_mask=sample_mask
     )
     sidecar_extra = {
         "ConfoundStrategy": VARIANT_DESCRIPTIONS["v2"],
@@ -156,7 +148,7 @@ def _extract_v2(bold, mask, conf_path, tr, atlas, masker):
     return timeseries, sidecar_extra
 
 
-def _extract_v3(bold, mask, conf_path, tr, atlas, masker):
+def _extract_v3(bold, bold_img, mask_img, conf_path, tr, atlas_maps, masker):
     """v3: Two-stage denoising (Abraham et al. 2017, Section 2.3)."""
     # Stage 1: voxel-level cleaning
     confounds_stage1, sample_mask = load_confounds(
@@ -168,18 +160,18 @@ def _extract_v3(bold, mask, conf_path, tr, atlas, masker):
         demean=True,
     )
     bold_clean = clean_img(
-        str(bold),
+        bold_img,
         confounds=confounds_stage1,
         low_pass=LOW_PASS,
         high_pass=0.01,
         t_r=tr,
         detrend=True,
-        mask_img=str(mask),
+        mask_img=mask_img,
     )
 
     # Stage 2: extract from clean BOLD (no filtering -- already done)
     masker_clean = NiftiMapsMasker(
-        maps_img=atlas.maps,
+        maps_img=atlas_maps,
         standardize="zscore_sample",
         detrend=False,
         low_pass=None,
@@ -189,11 +181,11 @@ def _extract_v3(bold, mask, conf_path, tr, atlas, masker):
     timeseries = masker_clean.fit_transform(bold_clean)
 
     # Stage 2b: regress tCompCor
-    confounds_tsv = pd.read_csv(conf_path, sep="\t")
     tcompcor_cols = sorted(
-        [c for c in confounds_tsv.columns if c.startswith("t_comp_cor_")]
+        c for c in confounds_columns(conf_path) if c.startswith("t_comp_cor_")
     )[:CONFOUND_N_COMPCOR]
     if tcompcor_cols:
+        confounds_tsv = pd.read_csv(conf_path, sep="\t", usecols=tcompcor_cols)
         timeseries = clean(
             timeseries,
             confounds=confounds_tsv[tcompcor_cols].values,
@@ -222,8 +214,16 @@ def extract_timeseries(
     run_label: str,
     project_root: Path,
     variant: str = "v1",
+    scratch_dir: Path | None = None,
+    overwrite: bool = False,
 ) -> dict:
-    """Extract MSDL time series for one subject/run."""
+    """Extract MSDL time series for one subject/run.
+
+    If ``scratch_dir`` is given, the gzipped BOLD and mask are inflated there
+    once and the uncompressed copies are used for all image reads.  Unless
+    ``overwrite`` is set, returns early when all outputs exist and their
+    sidecar records the current input fingerprint.
+    """
     fmriprep_dir = derivatives_fmriprep(project_root)
     conn_dir = derivatives_connectivity(project_root, variant=variant)
 
@@ -240,6 +240,22 @@ def extract_timeseries(
     bold = bold_path_from_confounds(conf_path)
     mask = brain_mask_from_confounds(conf_path)
 
+    # Reuse outputs that are complete and were produced from identical inputs,
+    # before staging checks, atlas fetch or any NIfTI/confounds load.
+    fingerprint = input_fingerprint(
+        (bold, mask, conf_path), **extraction_params(variant, run_label)
+    )
+    outputs = timeseries_outputs(subject_id, run_label, conn_dir)
+    previous = None if overwrite else current_sidecar(outputs, fingerprint)
+    if previous is not None:
+        return {
+            "status": "pass",
+            "n_volumes": previous["NumberOfVolumes"],
+            "mean_coverage": previous["MeanAtlasCoverage"],
+            "timeseries_path": str(outputs["timeseries"]),
+            "up_to_date": True,
+        }
+
     if not bold.exists():
         return {"status": "error", "reason": "BOLD file not found (not fetched?)"}
     if not mask.exists():
@@ -247,48 +263,57 @@ def extract_timeseries(
 
     tr = get_tr(conf_path)
 
-    atlas = fetch_atlas_msdl()
-    atlas_maps_img = nib.load(atlas.maps)
-    region_labels = list(atlas.labels)
+    region_labels = list(load_msdl_atlas()[2])
 
-    # Check atlas coverage
-    coverage = compute_atlas_coverage(mask, atlas_maps_img)
-    mean_coverage = float(coverage.mean())
+    with decompressed_nifti(bold, scratch_dir) as bold_input, \
+            decompressed_nifti(mask, scratch_dir) as mask_input:
+        bold_img = nib.load(str(bold_input))
+        mask_img = nib.load(str(mask_input))
 
-    if mean_coverage < MIN_ATLAS_COVERAGE:
-        return {
-            "status": "excluded",
-            "reason": f"low_coverage ({mean_coverage:.3f} < {MIN_ATLAS_COVERAGE})",
-            "mean_coverage": mean_coverage,
-        }
+        # MSDL maps on this subject's grid (cached across subjects sharing it)
+        atlas_maps = msdl_atlas_on_grid(mask_img)
 
-    # Build masker for v1/v2 (v3 builds its own internally)
-    masker = NiftiMapsMasker(
-        maps_img=atlas.maps,
-        standardize="zscore_sample",
-        detrend=False,
-        low_pass=LOW_PASS,
-        high_pass=None,  # handled by cosine confound regressors
-        t_r=tr,
-    )
+        # Check atlas coverage
+        coverage = compute_atlas_coverage(mask_img, atlas_maps)
+        mean_coverage = float(coverage.mean())
+
+        if mean_coverage < MIN_ATLAS_COVERAGE:
+            return {
+                "status": "excluded",
+                "reason": f"low_coverage ({mean_coverage:.3f} < {MIN_ATLAS_COVERAGE})",
+                "mean_coverage": mean_coverage,
+            }
 
-    # Run the selected extraction variant
-    extract_fn = _EXTRACT_FN[variant]
-    timeseries, sidecar_extra = extract_fn(bold, mask, conf_path, tr, atlas, masker)
+        # Build and fit masker for v1/v2 (v3 builds its own internally)
+        masker = NiftiMapsMasker(
+            maps_img=atlas_maps,
+            standardize="zscore_sample",
+            detrend=False,
+            low_pass=LOW_PASS,
+            high_pass=None,  # handled by cosine confound regressors
+            t_r=tr,
+        ).fit()
+
+        # Run the selected extraction variant; load_confounds needs the
+        # original BOLD path to locate the confounds TSV.
+        extract_fn = _EXTRACT_FN[variant]
+        timeseries, sidecar_extra = extract_fn(
+            bold, bold_img, mask_img, conf_path, tr, atlas_maps, masker
+        )
 
     # Compute per-subject Pearson correlation
     correlation = np.corrcoef(timeseries.T)
 
     # --- Write outputs ---
-    odir = output_dir(subject_id, conn_dir)
-    stem = bep017_stem(subject_id, run_label)
+    output_dir(subject_id, conn_dir)
+    # Drop any previous sidecar first, so an interrupted rewrite never leaves
+    # a sidecar that vouches for half-replaced outputs.
+    outputs["sidecar"].unlink(missing_ok=True)
 
     # 1. Time series (parquet)
-    ts_df = pd.DataFrame(timeseries, columns=region_labels)
-    ts_path = odir / f"{stem}_stat-mean_timeseries.parquet"
-    ts_df.to_parquet(ts_path, index=False)
+    write_timeseries_parquet(outputs["timeseries"], timeseries, region_labels)
 
-    # 2. Time series sidecar (JSON)
+    # Time series sidecar (JSON), written last in step 4
     sidecar = {
         "RepetitionTime": tr,
         "NumberOfVolumes": int(timeseries.shape[0]),
@@ -303,33 +328,26 @@ def extract_timeseries(
         "Standardize": "zscore_sample",
         "MeanAtlasCoverage": round(mean_coverage, 4),
         "SelectedRun": run_label,
+        "InputFingerprint": fingerprint,
         "SoftwareVersions": software_versions(),
         "Timestamp": datetime.now(timezone.utc).isoformat(),
     }
-    sidecar_path = odir / f"{stem}_stat-mean_timeseries.json"
-    with open(sidecar_path, "w") as f:
-        json.dump(sidecar, f, indent=2)
-
-    # 3. Coverage (TSV)
-    cov_df = pd.DataFrame({"region": region_labels, "coverage": coverage})
-    cov_path = odir / f"{stem}_stat-coverage_bold.tsv"
-    cov_df.to_csv(cov_path, sep="\t", index=False)
-
-    # 4. Pearson correlation (HDF5)
-    corr_path = odir / f"{stem}_stat-pearsoncorrelation_relmat.h5"
-    with h5py.File(corr_path, "w") as hf:
-        ds = hf.create_dataset("matrix", data=correlation, compression="gzip")
-        ds.attrs["regions"] = region_labels
-        ds.attrs["measure"] = "pearson_correlation"
-        ds.attrs["atlas"] = "MSDL"
-        ds.attrs["n_regions"] = N_MSDL_REGIONS
-        ds.attrs["tr"] = tr
+    # 2. Coverage (TSV)
+    write_coverage_tsv(outputs["coverage"], region_labels, coverage)
+
+    # 3. Pearson correlation (HDF5)
+    write_relmat_h5(
+        outputs["pearson"], correlation, region_labels, "pearson_correlation", tr=tr,
+    )
+
+    # 4. Sidecar last: it marks the whole output set as current
+    write_sidecar_json(outputs["sidecar"], sidecar)
 
     return {
         "status": "pass",
         "n_volumes": int(timeseries.shape[0]),
         "mean_coverage": round(mean_coverage, 4),
-        "timeseries_path": str(ts_path),
+        "timeseries_path": str(outputs["timeseries"]),
     }
 
 
@@ -348,6 +366,18 @@ def main():
         default=None,
         help="Run label (e.g., run-1). If omitted, reads from qc_prescreen.tsv.",
     )
+    parser.add_argument(
+        "--decompress-scratch",
+        type=Path,
+        default=None,
+        metavar="DIR",
+        help="Inflate BOLD/mask .nii.gz to DIR once before extraction.",
+    )
+    parser.add_argument(
+        "--overwrite",
+        action="store_true",
+        help="Re-extract even if outputs are up to date.",
+    )
     args = parser.parse_args()
     root = args.project_root.resolve()
     sub_id = args.participant_id
@@ -359,7 +389,9 @@ def main():
         if not qc_path.exists():
             # Fall back to default connectivity dir
             qc_path = derivatives_connectivity(root) / "qc_prescreen.tsv"
-        qc_df = pd.read_csv(qc_path, sep="\t")
+        qc_df = load_qc_prescreen(
+            qc_path, columns=["participant_id", "selected_run", "excluded_reason"]
+        )
         row = qc_df[qc_df["participant_id"] == sub_id]
         if row.empty:
             print(f"ERROR: {sub_id} not found in {qc_path}", file=sys.stderr, flush=True)
@@ -371,8 +403,18 @@ def main():
         run_label = row["selected_run"]
 
     print(f"Extracting: {sub_id} {run_label} (variant {variant})", flush=True)
-    result = extract_timeseries(sub_id, run_label, root, variant=variant)
-    print(f"  Status: {result['status']}", flush=True)
+    result = extract_timeseries(
+        sub_id,
+        run_label,
+        root,
+        variant=variant,
+        scratch_dir=args.decompress_scratch,
+        overwrite=args.overwrite,
+    )
+    status = result["status"]
+    if result.get("up_to_date"):
+        status += " (up to date)"
+    print(f"  Status: {status}", flush=True)
     if result["status"] == "pass":
         print(f"  Volumes: {result['n_volumes']}, Coverage: {result['mean_coverage']}", flush=True)
     elif "reason" in result:
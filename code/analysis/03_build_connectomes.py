@@ -3,7 +3,7 @@
 
 Loads all per-subject parquet time series, computes tangent embedding, and
 writes per-subject tangent relmat files plus a group-level stacked feature
-matrix.
+matrix and the per-subject LedoitWolf covariances reused by 04_classify.py.
 
 Usage::
 
@@ -25,8 +25,6 @@ from pathlib import Path
 import h5py
 import numpy as np
 import pandas as pd
-from nilearn.connectome import ConnectivityMeasure
-from nilearn.datasets import fetch_atlas_msdl
 
 
 def _setup_path():
@@ -40,9 +38,17 @@ _setup_path()
 from _helpers import (
     N_MSDL_REGIONS,
     N_TANGENT_FEATURES,
-    bep017_stem,
+    QC_ANALYSIS_COLUMNS,
+    TangentEmbeddingTransformer,
+    connectome_vectors,
     derivatives_connectivity,
-    output_dir,
+    load_msdl_atlas,
+    load_qc_prescreen,
+    read_timeseries_many,
+    save_group_covariances,
+    subject_covariances,
+    timeseries_outputs,
+    write_relmat_h5,
 )
 
 
@@ -54,22 +60,19 @@ def load_all_timeseries(
 
     Returns (list of T_i x 39 arrays, list of participant_ids).
     """
+    passed = qc_df[qc_df["excluded_reason"] == "pass"]
+    pairs = list(zip(passed["participant_id"], passed["selected_run"]))
+    arrays = read_timeseries_many(
+        timeseries_outputs(sub_id, run_label, conn_dir)["timeseries"]
+        for sub_id, run_label in pairs
+    )
+
     timeseries_list = []
     subject_ids = []
 
-    for _, row in qc_df.iterrows():
-        if row["excluded_reason"] != "pass":
-            continue
-        sub_id = row["participant_id"]
-        run_label = row["selected_run"]
-        stem = bep017_stem(sub_id, run_label)
-        ts_path = (
-            conn_dir / sub_id / "ses-1" / "func"
-            / f"{stem}_stat-mean_timeseries.parquet"
-        )
-        if not ts_path.exists():
+    for (sub_id, _), ts in zip(pairs, arrays):
+        if ts is None:
             continue
-        ts = pd.read_parquet(ts_path).values
         if ts.shape[1] != N_MSDL_REGIONS:
             print(f"WARNING: {sub_id} has {ts.shape[1]} regions, expected {N_MSDL_REGIONS}", flush=True)
             continue
@@ -83,7 +86,7 @@ def build_connectomes(project_root: Path, variant: str = "v1"):
     """Build tangent connectomes for all subjects."""
     conn_dir = derivatives_connectivity(project_root, variant=variant)
     qc_path = conn_dir / "qc_prescreen.tsv"
-    qc_df = pd.read_csv(qc_path, sep="\t")
+    qc_df = load_qc_prescreen(qc_path, columns=QC_ANALYSIS_COLUMNS)
 
     print("Loading time series...", flush=True)
     timeseries_list, subject_ids = load_all_timeseries(conn_dir, qc_df)
@@ -95,56 +98,62 @@ def build_connectomes(project_root: Path, variant: str = "v1"):
 
     # Compute tangent embedding
     print("Computing tangent embedding...", flush=True)
-    conn_measure = ConnectivityMeasure(
-        kind="tangent", vectorize=True, discard_diagonal=True
-    )
-    connectomes = conn_measure.fit_transform(timeseries_list)  # (N, 741)
+    # Fit once on full matrices (per-subject output) and vectorize those for
+    # the group features.  LedoitWolf covariances are estimated in batches
+    # instead of ConnectivityMeasure's per-subject loop.
+    subjects = np.arange(len(timeseries_list))
+    covariances = subject_covariances(timeseries_list)
+    tangent = TangentEmbeddingTransformer(covariances=covariances).fit(subjects)
+    tangent_matrices = tangent.tangent_matrices(subjects)  # (N, 39, 39)
+    connectomes = connectome_vectors(tangent_matrices)  # (N, 741)
     print(f"  Feature matrix shape: {connectomes.shape}", flush=True)
     assert connectomes.shape[1] == N_TANGENT_FEATURES
 
-    # Get the full tangent matrices (not vectorized) for per-subject output
-    conn_full = ConnectivityMeasure(kind="tangent", vectorize=False)
-    tangent_matrices = conn_full.fit_transform(timeseries_list)  # (N, 39, 39)
-
     # Get region labels
-    atlas = fetch_atlas_msdl()
-    region_labels = list(atlas.labels)
+    region_labels = list(load_msdl_atlas()[2])
+
+    # QC rows aligned to subject_ids (one indexed lookup instead of a
+    # full-table mask per subject)
+    qc_pass = qc_df.set_index("participant_id").loc[subject_ids]
 
     # --- Per-subject tangent relmat ---
+    # The label attribute is encoded once and reused for every subject.
     print("Writing per-subject tangent relmat files...", flush=True)
-    for i, sub_id in enumerate(subject_ids):
-        row = qc_df[qc_df["participant_id"] == sub_id].iloc[0]
-        run_label = row["selected_run"]
-        stem = bep017_stem(sub_id, run_label)
-        odir = output_dir(sub_id, conn_dir)
-        relmat_path = odir / f"{stem}_stat-tangent_relmat.h5"
-
-        with h5py.File(relmat_path, "w") as hf:
-            ds = hf.create_dataset(
-                "matrix", data=tangent_matrices[i], compression="gzip"
-            )
-            ds.attrs["regions"] = region_labels
-            ds.attrs["measure"] = "tangent"
-            ds.attrs["atlas"] = "MSDL"
-            ds.attrs["n_regions"] = N_MSDL_REGIONS
+    regions_attr = np.array(region_labels, dtype=h5py.string_dtype())
+    for i, (sub_id, run_label) in enumerate(zip(subject_ids, qc_pass["selected_run"])):
+        # The directory exists: the subject's time series was read from it
+        relmat_path = timeseries_outputs(sub_id, run_label, conn_dir)["tangent"]
+        write_relmat_h5(relmat_path, tangent_matrices[i], regions_attr, "tangent")
 
     # --- Group-level stacked features ---
     print("Writing group-level feature matrix...", flush=True)
     group_dir = conn_dir / "group"
     group_dir.mkdir(parents=True, exist_ok=True)
 
-    # Merge with phenotypic data for labels
-    qc_pass = qc_df[qc_df["participant_id"].isin(subject_ids)].set_index("participant_id")
-    qc_pass = qc_pass.loc[subject_ids]  # maintain order
-
-    np.savez_compressed(
-        group_dir / "group_atlas-MSDL_stat-tangent_relmat.npz",
-        connectomes=connectomes,
-        participant_ids=np.array(subject_ids),
-        dx_group=qc_pass["group"].values,
-        source_dataset=qc_pass["source_dataset"].values,
-        source_site=qc_pass["source_site"].values,
-    )
+    group_path = group_dir / "group_atlas-MSDL_stat-tangent_relmat.h5"
+    str_dtype = h5py.string_dtype()
+    with h5py.File(group_path, "w", libver="latest") as hf:
+        hf.create_dataset(
+            "connectomes",
+            data=connectomes.astype(np.float32, copy=False),
+            chunks=(min(64, len(subject_ids)), N_TANGENT_FEATURES),
+            compression="gzip",
+            compression_opts=1,
+            shuffle=True,
+        )
+        hf.create_dataset("participant_ids", data=subject_ids, dtype=str_dtype)
+        for name, column in (
+            ("dx_group", "group"),
+            ("source_dataset", "source_dataset"),
+            ("source_site", "source_site"),
+        ):
+            hf.create_dataset(
+                name, data=qc_pass[column].astype(str).tolist(), dtype=str_dtype
+            )
+
+    # Covariances for 04_classify.py, which memory-maps them instead of
+    # re-reading every parquet time series
+    save_group_covariances(covariances, subject_ids, conn_dir)
 
     # Metadata JSON
     meta = {
@@ -155,13 +164,14 @@ def build_connectomes(project_root: Path, variant: str = "v1"):
         "ConnectivityMeasure": "tangent",
         "Vectorized": True,
         "DiscardDiagonal": True,
+        "DataType": "float32",
         "Timestamp": datetime.now(timezone.utc).isoformat(),
     }
     with open(group_dir / "group_atlas-MSDL_stat-tangent_relmat.json", "w") as f:
         json.dump(meta, f, indent=2)
 
     print(f"\nDone. {len(subject_ids)} subjects, {connectomes.shape[1]} features.", flush=True)
-    print(f"  Group file: {group_dir / 'group_atlas-MSDL_stat-tangent_relmat.npz'}", flush=True)
+    print(f"  Group file: {group_path}", flush=True)
 
 
 def main():
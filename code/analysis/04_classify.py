@@ -2,7 +2,8 @@
 """Classification with tangent embedding and cross-validation.
 
 Implements the Abraham et al. (2017) replication:
-  - TangentEmbeddingTransformer (re-fits geometric mean per CV fold)
+  - TangentEmbeddingTransformer (re-fits geometric mean per CV fold over
+    per-subject LedoitWolf covariances that are estimated only once)
   - RidgeClassifier (primary) + SVC(kernel="linear")
   - Inter-site CV (LeaveOneGroupOut)
   - Intra-site CV (StratifiedShuffleSplit, 100 splits, 20% test)
@@ -22,7 +23,7 @@ from datetime import datetime, timezone
 from pathlib import Path
 
 import numpy as np
-import pandas as pd
+from joblib import Parallel, delayed
 from sklearn.linear_model import RidgeClassifier
 from sklearn.model_selection import LeaveOneGroupOut, StratifiedShuffleSplit
 from sklearn.pipeline import Pipeline
@@ -37,7 +38,19 @@ def _setup_path():
 
 _setup_path()
 
-from _helpers import N_MSDL_REGIONS, RANDOM_STATE, TangentEmbeddingTransformer, derivatives_connectivity
+from _helpers import (
+    N_MSDL_REGIONS,
+    QC_ANALYSIS_COLUMNS,
+    RANDOM_STATE,
+    TangentEmbeddingTransformer,
+    derivatives_connectivity,
+    load_group_covariances,
+    load_qc_prescreen,
+    read_timeseries_many,
+    site_indices,
+    subject_covariances,
+    timeseries_outputs,
+)
 
 
 # --------------------------------------------------------------------------- #
@@ -45,56 +58,84 @@ from _helpers import N_MSDL_REGIONS, RANDOM_STATE, TangentEmbeddingTransformer,
 # --------------------------------------------------------------------------- #
 
 
+def _fold_n_correct(covariances, labels, classifier_name, train_idx, test_idx,
+                    tangent_params=None) -> int:
+    """Fit tangent + classifier on one fold of subject indices.
+
+    Returns the number of correctly classified test subjects, so callers
+    aggregate plain counts instead of sharing prediction buffers.
+    """
+    pipe = Pipeline([
+        ("tangent", TangentEmbeddingTransformer(covariances=covariances, **(tangent_params or {}))),
+        ("classifier", _make_classifier(classifier_name)),
+    ])
+    pipe.fit(train_idx, labels[train_idx])
+    return int((pipe.predict(test_idx) == labels[test_idx]).sum())
+
+
 def run_intersite_cv(
-    timeseries: list[np.ndarray],
+    covariances: np.ndarray,
     labels: np.ndarray,
     sites: np.ndarray,
     classifier_name: str = "ridge",
+    n_jobs: int = 1,
+    feature_dtype: str | None = None,
+    mean_init: np.ndarray | None = None,
 ) -> dict:
     """Leave-one-site-out cross-validation.
 
-    Returns dict with per-site accuracy and unweighted mean.
+    ``covariances`` holds one precomputed ``(R, R)`` matrix per subject;
+    folds pass subject indices through the pipeline instead of time series
+    and run on ``n_jobs`` joblib workers.  ``mean_init`` warm-starts each
+    fold's geometric mean.
+    Returns dict with per-site accuracy, their unweighted mean and the
+    accuracy pooled over all test subjects.
     """
-    clf = _make_classifier(classifier_name)
     logo = LeaveOneGroupOut()
-
-    unique_sites = np.unique(sites)
+    tangent_params = {"dtype": feature_dtype, "mean_init": mean_init}
+
+    # Per-site subject and class counts in one pass over all subjects
+    unique_sites, site_codes, n_per_site = np.unique(
+        sites, return_inverse=True, return_counts=True
+    )
+    n_asd_per_site = np.bincount(site_codes[labels == 1], minlength=len(unique_sites))
+    n_tc_per_site = np.bincount(site_codes[labels == 0], minlength=len(unique_sites))
     site_results = {}
+    subjects = np.arange(len(labels))
 
-    for train_idx, test_idx in logo.split(timeseries, labels, groups=sites):
-        test_site = sites[test_idx[0]]
-        X_train = [timeseries[i] for i in train_idx]
-        X_test = [timeseries[i] for i in test_idx]
-        y_train, y_test = labels[train_idx], labels[test_idx]
-
-        pipe = Pipeline([
-            ("tangent", TangentEmbeddingTransformer()),
-            ("classifier", clf),
-        ])
-        pipe.fit(X_train, y_train)
-        accuracy = pipe.score(X_test, y_test)
-
-        site_results[test_site] = {
-            "accuracy": round(float(accuracy), 6),
-            "n_test": int(len(test_idx)),
-            "n_asd": int((y_test == 1).sum()),
-            "n_tc": int((y_test == 0).sum()),
+    folds = list(logo.split(subjects, labels, groups=sites))
+    n_correct = Parallel(n_jobs=n_jobs)(
+        delayed(_fold_n_correct)(
+            covariances, labels, classifier_name, train_idx, test_idx, tangent_params,
+        )
+        for train_idx, test_idx in folds
+    )
+
+    for (_, test_idx), correct in zip(folds, n_correct):
+        code = site_codes[test_idx[0]]
+        site_results[unique_sites[code]] = {
+            "accuracy": round(correct / len(test_idx), 6),
+            "n_test": int(n_per_site[code]),
+            "n_asd": int(n_asd_per_site[code]),
+            "n_tc": int(n_tc_per_site[code]),
         }
 
     accuracies = [v["accuracy"] for v in site_results.values()]
     return {
         "cv_scheme": "intersite_leave_one_site_out",
         "classifier": classifier_name,
+        "feature_dtype": feature_dtype or "float64",
         "n_sites": len(unique_sites),
         "n_subjects": len(labels),
         "mean_accuracy": round(float(np.mean(accuracies)), 6),
         "std_accuracy": round(float(np.std(accuracies)), 6),
+        "pooled_accuracy": round(sum(n_correct) / len(labels), 6),
         "per_site": site_results,
     }
 
 
 def run_intrasite_cv(
-    timeseries: list[np.ndarray],
+    covariances: np.ndarray,
     labels: np.ndarray,
     sites: np.ndarray,
     classifier_name: str = "ridge",
@@ -103,17 +144,23 @@ def run_intrasite_cv(
     random_state: int = 42,
     min_subjects: int = 10,
     min_per_class: int = 5,
+    n_jobs: int = 1,
+    feature_dtype: str | None = None,
+    mean_init: np.ndarray | None = None,
 ) -> dict:
     """Intra-site stratified shuffle split cross-validation.
 
+    Splits of each site run on ``n_jobs`` joblib workers; ``mean_init``
+    warm-starts each split's geometric mean.
     Returns per-site median accuracy.
     """
-    unique_sites = np.unique(sites)
+    site_to_idx = site_indices(sites)
     site_results = {}
+    parallel = Parallel(n_jobs=n_jobs)
+    tangent_params = {"dtype": feature_dtype, "mean_init": mean_init}
 
-    for site in unique_sites:
-        site_mask = sites == site
-        y_site = labels[site_mask]
+    for site, subjects_site in site_to_idx.items():
+        y_site = labels[subjects_site]
 
         # Check minimum requirements
         if len(y_site) < min_subjects:
@@ -121,30 +168,25 @@ def run_intrasite_cv(
         if (y_site == 1).sum() < min_per_class or (y_site == 0).sum() < min_per_class:
             continue
 
-        ts_site = [timeseries[i] for i, m in enumerate(site_mask) if m]
         sss = StratifiedShuffleSplit(
             n_splits=n_splits, test_size=test_size, random_state=random_state
         )
 
-        fold_accs = []
-        for train_idx, test_idx in sss.split(ts_site, y_site):
-            X_train = [ts_site[i] for i in train_idx]
-            X_test = [ts_site[i] for i in test_idx]
-            y_train, y_test = y_site[train_idx], y_site[test_idx]
-
-            clf = _make_classifier(classifier_name)
-            pipe = Pipeline([
-                ("tangent", TangentEmbeddingTransformer()),
-                ("classifier", clf),
-            ])
-            pipe.fit(X_train, y_train)
-            fold_accs.append(pipe.score(X_test, y_test))
+        splits = list(sss.split(subjects_site, y_site))
+        n_correct = parallel(
+            delayed(_fold_n_correct)(
+                covariances, labels, classifier_name,
+                subjects_site[train_idx], subjects_site[test_idx], tangent_params,
+            )
+            for train_idx, test_idx in splits
+        )
+        fold_accs = [c / len(test_idx) for c, (_, test_idx) in zip(n_correct, splits)]
 
         site_results[site] = {
             "median_accuracy": round(float(np.median(fold_accs)), 6),
             "mean_accuracy": round(float(np.mean(fold_accs)), 6),
             "std_accuracy": round(float(np.std(fold_accs)), 6),
-            "n_subjects": int(site_mask.sum()),
+            "n_subjects": int(len(subjects_site)),
             "n_asd": int((y_site == 1).sum()),
             "n_tc": int((y_site == 0).sum()),
         }
@@ -153,20 +195,32 @@ def run_intrasite_cv(
     return {
         "cv_scheme": "intrasite_stratified_shuffle_split",
         "classifier": classifier_name,
+        "feature_dtype": feature_dtype or "float64",
         "n_splits": n_splits,
         "test_size": test_size,
         "random_state": random_state,
         "n_sites_evaluated": len(site_results),
-        "n_sites_skipped": len(unique_sites) - len(site_results),
+        "n_sites_skipped": len(site_to_idx) - len(site_results),
         "mean_of_medians": round(float(np.mean(median_accs)), 6) if median_accs else None,
         "per_site": site_results,
     }
 
 
+def _sample_mean(covariances: np.ndarray) -> np.ndarray:
+    """Geometric mean of all covariances, used to warm-start the fold means."""
+    subjects = np.arange(len(covariances))
+    return TangentEmbeddingTransformer(covariances=covariances).fit(subjects).mean_
+
+
 def _make_classifier(name: str):
     if name == "ridge":
-        return RidgeClassifier()
+        # Dense 741-feature design: the normal equations are solved directly
+        # (what "auto" resolves to) without the solver dispatch per fold.
+        return RidgeClassifier(solver="cholesky")
     elif name == "svc":
+        # Kept as libsvm's linear kernel: LinearSVC optimizes a different
+        # objective (squared hinge, penalized intercept) and would change
+        # the replicated accuracies.
         return SVC(kernel="linear")
     else:
         raise ValueError(f"Unknown classifier: {name}")
@@ -177,51 +231,52 @@ def _make_classifier(name: str):
 # --------------------------------------------------------------------------- #
 
 
-def classify(project_root: Path, variant: str = "v1"):
+def classify(
+    project_root: Path,
+    variant: str = "v1",
+    n_jobs: int = 1,
+    feature_dtype: str | None = None,
+):
     """Run all classification experiments."""
     np.random.seed(RANDOM_STATE)
     conn_dir = derivatives_connectivity(project_root, variant=variant)
     qc_path = conn_dir / "qc_prescreen.tsv"
 
-    qc_df = pd.read_csv(qc_path, sep="\t")
+    qc_df = load_qc_prescreen(qc_path, columns=QC_ANALYSIS_COLUMNS)
     qc_pass = qc_df[qc_df["excluded_reason"] == "pass"].copy()
 
-    # Load time series
-    print("Loading time series...", flush=True)
-    from _helpers import bep017_stem
-
-    timeseries_all = []
-    labels_all = []
-    sites_all = []
-    datasets_all = []
-    subject_ids = []
-
-    for _, row in qc_pass.iterrows():
-        sub_id = row["participant_id"]
-        run_label = row["selected_run"]
-        stem = bep017_stem(sub_id, run_label)
-        ts_path = (
-            conn_dir / sub_id / "ses-1" / "func"
-            / f"{stem}_stat-mean_timeseries.parquet"
-        )
-        if not ts_path.exists():
-            continue
-        ts = pd.read_parquet(ts_path).values
-        if ts.shape[1] != N_MSDL_REGIONS:
-            continue
-        timeseries_all.append(ts)
-        labels_all.append(1 if row["group"] == "ASD" else 0)
-        # Use dataset-qualified site name to avoid collisions (e.g., UCLA_1
-        # appears in both ABIDE I and II as distinct sites/scanners)
-        sites_all.append(f"{row['source_dataset']}_{row['source_site']}")
-        datasets_all.append(row["source_dataset"])
-        subject_ids.append(sub_id)
-
-    labels_all = np.array(labels_all)
-    sites_all = np.array(sites_all)
-    datasets_all = np.array(datasets_all)
-
-    print(f"  Loaded {len(timeseries_all)} subjects "
+    ts_paths = [
+        timeseries_outputs(sub_id, run_label, conn_dir)["timeseries"]
+        for sub_id, run_label in zip(qc_pass["participant_id"], qc_pass["selected_run"])
+    ]
+
+    # Per-subject covariances are invariant across folds; reuse the ones
+    # saved by 03_build_connectomes.py when they are still current.
+    cached = load_group_covariances(conn_dir, [qc_path, *ts_paths])
+    if cached is not None and set(cached[1]) <= set(qc_pass["participant_id"]):
+        print("Memory-mapping cached covariances...", flush=True)
+        covariances_all, subject_ids = cached
+    else:
+        print("Loading time series...", flush=True)
+        timeseries_all = []
+        subject_ids = []
+        for sub_id, ts in zip(qc_pass["participant_id"], read_timeseries_many(ts_paths)):
+            if ts is None or ts.shape[1] != N_MSDL_REGIONS:
+                continue
+            timeseries_all.append(ts)
+            subject_ids.append(sub_id)
+        covariances_all = subject_covariances(timeseries_all)
+
+    rows = qc_pass.set_index("participant_id").loc[subject_ids]
+    labels_all = (rows["group"] == "ASD").to_numpy(dtype=int)
+    # Use dataset-qualified site name to avoid collisions (e.g., UCLA_1
+    # appears in both ABIDE I and II as distinct sites/scanners)
+    sites_all = (
+        rows["source_dataset"].astype(str) + "_" + rows["source_site"].astype(str)
+    ).to_numpy()
+    datasets_all = rows["source_dataset"].to_numpy()
+
+    print(f"  Loaded {len(subject_ids)} subjects "
           f"({(labels_all == 1).sum()} ASD, {(labels_all == 0).sum()} TC)", flush=True)
 
     # Create classification output directory
@@ -230,15 +285,18 @@ def classify(project_root: Path, variant: str = "v1"):
 
     # --- Experiment 1: ABIDE I only ---
     abide1_mask = datasets_all == "abide1"
-    ts_a1 = [timeseries_all[i] for i in range(len(timeseries_all)) if abide1_mask[i]]
+    cov_a1 = covariances_all[abide1_mask]
     y_a1 = labels_all[abide1_mask]
     sites_a1 = sites_all[abide1_mask]
 
-    print(f"\n=== Experiment 1: ABIDE I only (N={len(ts_a1)}) ===", flush=True)
+    print(f"\n=== Experiment 1: ABIDE I only (N={len(cov_a1)}) ===", flush=True)
+    mean_a1 = _sample_mean(cov_a1)
 
     for clf_name in ("ridge", "svc"):
         print(f"\n  Inter-site CV ({clf_name})...", flush=True)
-        result = run_intersite_cv(ts_a1, y_a1, sites_a1, clf_name)
+        result = run_intersite_cv(cov_a1, y_a1, sites_a1, clf_name,
+                                  n_jobs=n_jobs, feature_dtype=feature_dtype,
+                                  mean_init=mean_a1)
         result["experiment"] = "abide1"
         result["timestamp"] = datetime.now(timezone.utc).isoformat()
         out_path = cls_dir / f"results_intersite_abide1_{clf_name}.json"
@@ -248,7 +306,9 @@ def classify(project_root: Path, variant: str = "v1"):
               f"(+/- {result['std_accuracy']:.4f})", flush=True)
 
         print(f"  Intra-site CV ({clf_name})...", flush=True)
-        result = run_intrasite_cv(ts_a1, y_a1, sites_a1, clf_name)
+        result = run_intrasite_cv(cov_a1, y_a1, sites_a1, clf_name,
+                                  n_jobs=n_jobs, feature_dtype=feature_dtype,
+                                  mean_init=mean_a1)
         result["experiment"] = "abide1"
         result["timestamp"] = datetime.now(timezone.utc).isoformat()
         out_path = cls_dir / f"results_intrasite_abide1_{clf_name}.json"
@@ -258,11 +318,14 @@ def classify(project_root: Path, variant: str = "v1"):
             print(f"    Mean of medians: {result['mean_of_medians']:.4f}", flush=True)
 
     # --- Experiment 2: ABIDE I + II combined ---
-    print(f"\n=== Experiment 2: ABIDE I+II combined (N={len(timeseries_all)}) ===", flush=True)
+    print(f"\n=== Experiment 2: ABIDE I+II combined (N={len(covariances_all)}) ===", flush=True)
+    mean_all = _sample_mean(covariances_all)
 
     for clf_name in ("ridge", "svc"):
         print(f"\n  Inter-site CV ({clf_name})...", flush=True)
-        result = run_intersite_cv(timeseries_all, labels_all, sites_all, clf_name)
+        result = run_intersite_cv(covariances_all, labels_all, sites_all, clf_name,
+                                  n_jobs=n_jobs, feature_dtype=feature_dtype,
+                                  mean_init=mean_all)
         result["experiment"] = "both"
         result["timestamp"] = datetime.now(timezone.utc).isoformat()
         out_path = cls_dir / f"results_intersite_both_{clf_name}.json"
@@ -272,7 +335,9 @@ def classify(project_root: Path, variant: str = "v1"):
               f"(+/- {result['std_accuracy']:.4f})", flush=True)
 
         print(f"  Intra-site CV ({clf_name})...", flush=True)
-        result = run_intrasite_cv(timeseries_all, labels_all, sites_all, clf_name)
+        result = run_intrasite_cv(covariances_all, labels_all, sites_all, clf_name,
+                                  n_jobs=n_jobs, feature_dtype=feature_dtype,
+                                  mean_init=mean_all)
         result["experiment"] = "both"
         result["timestamp"] = datetime.now(timezone.utc).isoformat()
         out_path = cls_dir / f"results_intrasite_both_{clf_name}.json"
@@ -288,8 +353,17 @@ def main():
     parser = argparse.ArgumentParser(description=__doc__)
     parser.add_argument("--project-root", type=Path, default=Path("."))
     parser.add_argument("--variant", default="v1", help="Connectivity variant.")
+    parser.add_argument("--jobs", type=int, default=1,
+                        help="Parallel CV folds (joblib; -1 uses all cores).")
+    parser.add_argument("--float32", action="store_true",
+                        help="Feed float32 tangent features to the classifiers.")
     args = parser.parse_args()
-    classify(args.project_root.resolve(), variant=args.variant)
+    classify(
+        args.project_root.resolve(),
+        variant=args.variant,
+        n_jobs=args.jobs,
+        feature_dtype="float32" if args.float32 else None,
+    )
 
 
 if __name__ == "__main__":
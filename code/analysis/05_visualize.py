@@ -13,6 +13,10 @@ import json
 import sys
 from pathlib import Path
 
+import matplotlib
+
+matplotlib.use("Agg")  # batch rendering only; skip interactive backend setup
+
 import matplotlib.pyplot as plt
 import numpy as np
 import pandas as pd
@@ -27,15 +31,25 @@ def _setup_path():
 
 _setup_path()
 
-from _helpers import derivatives_connectivity
+from _helpers import derivatives_connectivity, load_qc_prescreen
+
+
+def _parse_results_key(stem: str) -> tuple[str, str, str]:
+    """Split ``results_<cv>_<experiment>_<classifier>`` into its parts."""
+    parts = stem[len("results_"):].split("_")
+    return parts[0], parts[1] if len(parts) > 1 else "", "_".join(parts[2:]) or "ridge"
 
 
 def load_classification_results(cls_dir: Path) -> dict:
-    """Load all classification JSON results."""
+    """Load all classification JSON results.
+
+    Keys are ``(cv, experiment, classifier)`` tuples parsed once from the
+    file names, e.g. ``("intersite", "abide1", "ridge")``.
+    """
     results = {}
     for fp in sorted(cls_dir.glob("results_*.json")):
         with open(fp) as f:
-            results[fp.stem] = json.load(f)
+            results[_parse_results_key(fp.stem)] = json.load(f)
     return results
 
 
@@ -49,17 +63,15 @@ def plot_intersite_comparison(results: dict, fig_dir: Path):
         "intra_accuracy": 0.669,
     }
 
-    fig, ax = plt.subplots(figsize=(8, 5))
-
     # Our ABIDE I results
-    for key, res in results.items():
-        if "intersite_abide1_ridge" in key:
-            our_inter = res["mean_accuracy"]
-            our_inter_std = res["std_accuracy"]
-            break
-    else:
+    res = results.get(("intersite", "abide1", "ridge"))
+    if res is None:
         print("WARNING: No ABIDE I inter-site ridge results found", flush=True)
         return
+    our_inter = res["mean_accuracy"]
+    our_inter_std = res["std_accuracy"]
+
+    fig, ax = plt.subplots(figsize=(8, 5))
 
     labels = ["Abraham et al.\n(C-PAC, N=871)", "This study\n(fMRIPrep, ABIDE I)"]
     values = [abraham_ref["inter_accuracy"], our_inter]
@@ -84,79 +96,82 @@ def plot_intersite_comparison(results: dict, fig_dir: Path):
     print(f"  Saved intersite_comparison.{{png,svg}}", flush=True)
 
 
+_EXPERIMENT_LABELS = {"abide1": "ABIDE I", "both": "ABIDE I+II"}
+
+
+def _site_bar_panel(ax, sites, values, errors, mean, color, ylabel, title):
+    """Draw one per-site bar panel (sites on x, accuracy on y) on ``ax``."""
+    ax.bar(range(len(sites)), values, yerr=errors, capsize=3 if errors else 0,
+           color=color, edgecolor="black", linewidth=0.3)
+    ax.set_xticks(range(len(sites)))
+    ax.set_xticklabels(sites, rotation=90, fontsize=7)
+    ax.set_ylabel(ylabel)
+    ax.set_xlabel("Site")
+    if mean is not None:
+        ax.axhline(mean, color="red", linestyle="--", label=f"Mean: {mean:.1%}")
+    ax.axhline(0.5, color="gray", linestyle=":", label="Chance")
+    ax.set_ylim(0, 1)
+    ax.legend()
+    ax.set_title(title)
+
+
+def _save_site_panels(panels, fig_dir: Path, name: str, min_width: float):
+    """Render all experiment panels into one figure (one row each) and save it."""
+    if not panels:
+        return
+    width = max(min_width, max(len(p["sites"]) for p in panels) * 0.4)
+    fig, axes = plt.subplots(len(panels), 1, figsize=(width, 5 * len(panels)),
+                             sharey=True, squeeze=False)
+    for ax, panel in zip(axes[:, 0], panels):
+        _site_bar_panel(ax, **panel)
+
+    fig.tight_layout()
+    fig.savefig(fig_dir / f"{name}.png", dpi=150)
+    fig.savefig(fig_dir / f"{name}.svg")
+    plt.close(fig)
+    print(f"  Saved {name}.{{png,svg}}", flush=True)
+
+
 def plot_persite_accuracy(results: dict, fig_dir: Path):
-    """Per-site accuracy bar chart for inter-site CV."""
-    for experiment in ("abide1", "both"):
-        key = f"results_intersite_{experiment}_ridge"
-        if key not in results:
+    """Per-site accuracy bar charts for inter-site CV (one row per experiment)."""
+    panels = []
+    for experiment, label in _EXPERIMENT_LABELS.items():
+        res = results.get(("intersite", experiment, "ridge"))
+        if res is None:
             continue
-        res = results[key]
         per_site = res["per_site"]
-
         sites = sorted(per_site.keys())
-        accs = [per_site[s]["accuracy"] for s in sites]
-        n_test = [per_site[s]["n_test"] for s in sites]
-
-        fig, ax = plt.subplots(figsize=(max(12, len(sites) * 0.4), 5))
-        colors = ["#4c9ed9" if "v1s" in s or experiment == "abide1"
-                   else "#d94c4c" for s in sites]
-        # Actually color by site name not prefix since per_site keys are site names
-        ax.bar(range(len(sites)), accs, color="#4c9ed9", edgecolor="black",
-               linewidth=0.3)
-        ax.set_xticks(range(len(sites)))
-        ax.set_xticklabels(sites, rotation=90, fontsize=7)
-        ax.set_ylabel("Accuracy")
-        ax.set_xlabel("Site")
-        ax.axhline(res["mean_accuracy"], color="red", linestyle="--",
-                    label=f"Mean: {res['mean_accuracy']:.1%}")
-        ax.axhline(0.5, color="gray", linestyle=":", label="Chance")
-        ax.set_ylim(0, 1)
-        ax.legend()
-        label = "ABIDE I" if experiment == "abide1" else "ABIDE I+II"
-        ax.set_title(f"Per-site accuracy (inter-site CV, Ridge) -- {label}")
-
-        fig.tight_layout()
-        fig.savefig(fig_dir / f"persite_accuracy_{experiment}.png", dpi=150)
-        fig.savefig(fig_dir / f"persite_accuracy_{experiment}.svg")
-        plt.close(fig)
-        print(f"  Saved persite_accuracy_{experiment}.{{png,svg}}", flush=True)
+        panels.append({
+            "sites": sites,
+            "values": [per_site[s]["accuracy"] for s in sites],
+            "errors": None,
+            "mean": res["mean_accuracy"],
+            "color": "#4c9ed9",
+            "ylabel": "Accuracy",
+            "title": f"Per-site accuracy (inter-site CV, Ridge) -- {label}",
+        })
+    _save_site_panels(panels, fig_dir, "persite_accuracy", min_width=12)
 
 
 def plot_intrasite_boxplot(results: dict, fig_dir: Path):
-    """Intra-site accuracy box plots."""
-    for experiment in ("abide1", "both"):
-        key = f"results_intrasite_{experiment}_ridge"
-        if key not in results:
+    """Intra-site accuracy bar charts (one row per experiment)."""
+    panels = []
+    for experiment, label in _EXPERIMENT_LABELS.items():
+        res = results.get(("intrasite", experiment, "ridge"))
+        if res is None:
             continue
-        res = results[key]
         per_site = res["per_site"]
-
         sites = sorted(per_site.keys())
-        medians = [per_site[s]["median_accuracy"] for s in sites]
-        means = [per_site[s]["mean_accuracy"] for s in sites]
-        stds = [per_site[s]["std_accuracy"] for s in sites]
-
-        fig, ax = plt.subplots(figsize=(max(10, len(sites) * 0.4), 5))
-        ax.bar(range(len(sites)), medians, yerr=stds, capsize=3,
-               color="#7fbf7f", edgecolor="black", linewidth=0.3)
-        ax.set_xticks(range(len(sites)))
-        ax.set_xticklabels(sites, rotation=90, fontsize=7)
-        ax.set_ylabel("Median accuracy (100 splits)")
-        ax.set_xlabel("Site")
-        if res["mean_of_medians"] is not None:
-            ax.axhline(res["mean_of_medians"], color="red", linestyle="--",
-                        label=f"Mean: {res['mean_of_medians']:.1%}")
-        ax.axhline(0.5, color="gray", linestyle=":", label="Chance")
-        ax.set_ylim(0, 1)
-        ax.legend()
-        label = "ABIDE I" if experiment == "abide1" else "ABIDE I+II"
-        ax.set_title(f"Intra-site accuracy (100 shuffle splits, Ridge) -- {label}")
-
-        fig.tight_layout()
-        fig.savefig(fig_dir / f"intrasite_accuracy_{experiment}.png", dpi=150)
-        fig.savefig(fig_dir / f"intrasite_accuracy_{experiment}.svg")
-        plt.close(fig)
-        print(f"  Saved intrasite_accuracy_{experiment}.{{png,svg}}", flush=True)
+        panels.append({
+            "sites": sites,
+            "values": [per_site[s]["median_accuracy"] for s in sites],
+            "errors": [per_site[s]["std_accuracy"] for s in sites],
+            "mean": res["mean_of_medians"],
+            "color": "#7fbf7f",
+            "ylabel": "Median accuracy (100 splits)",
+            "title": f"Intra-site accuracy (100 shuffle splits, Ridge) -- {label}",
+        })
+    _save_site_panels(panels, fig_dir, "intrasite_accuracy", min_width=10)
 
 
 def write_comparison_table(results: dict, fig_dir: Path):
@@ -172,8 +187,8 @@ def write_comparison_table(results: dict, fig_dir: Path):
         "Intra-site Accuracy": "66.9%",
     }
 
-    our_inter = results.get("results_intersite_abide1_ridge", {})
-    our_intra = results.get("results_intrasite_abide1_ridge", {})
+    our_inter = results.get(("intersite", "abide1", "ridge"), {})
+    our_intra = results.get(("intrasite", "abide1", "ridge"), {})
 
     ours = {
         "Source": "This study",
@@ -205,7 +220,7 @@ def write_consort_flowchart(project_root: Path, fig_dir: Path):
         print("  WARNING: qc_prescreen.tsv not found, skipping CONSORT flowchart", flush=True)
         return
 
-    qc_df = pd.read_csv(qc_path, sep="\t")
+    qc_df = load_qc_prescreen(qc_path, columns=["source_dataset", "excluded_reason"])
 
     n_total = 2194
     n_preproc_excl = 46
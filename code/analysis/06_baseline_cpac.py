@@ -19,7 +19,6 @@ from datetime import datetime, timezone
 from pathlib import Path
 
 import numpy as np
-import pandas as pd
 from nilearn.datasets import fetch_abide_pcp
 from sklearn.linear_model import RidgeClassifier
 from sklearn.model_selection import LeaveOneGroupOut, StratifiedShuffleSplit
@@ -40,6 +39,9 @@ from _helpers import (
     RANDOM_STATE,
     TangentEmbeddingTransformer,
     derivatives_connectivity,
+    read_timeseries_parquet,
+    site_indices,
+    subject_covariances,
 )
 
 
@@ -59,21 +61,22 @@ def load_cpac_timeseries(project_root: Path, data_dir: str | None = None):
     sites = []
     subject_ids = []
 
-    for i in range(len(phenotypic)):
-        dx = int(phenotypic["DX_GROUP"].iloc[i])
-        site = str(phenotypic["SITE_ID"].iloc[i])
-        sub_id = str(int(phenotypic["SUB_ID"].iloc[i])).zfill(7)
-        sub_label = f"sub-{sub_id}"
+    # Convert the needed phenotypic columns once instead of per-row .iloc
+    dx_all = phenotypic["DX_GROUP"].astype(int).to_numpy()
+    site_all = phenotypic["SITE_ID"].astype(str).to_numpy()
+    sub_all = phenotypic["SUB_ID"].astype(int).astype(str).str.zfill(7).to_numpy()
 
+    for dx, site, sub_id in zip(dx_all, site_all, sub_all):
         if dx not in (1, 2):
             continue
+        sub_label = f"sub-{sub_id}"
 
         func_dir = conn_dir / sub_label / "ses-1" / "func"
         parquets = list(func_dir.glob("*_timeseries.parquet")) if func_dir.is_dir() else []
         if not parquets:
             continue
 
-        ts = pd.read_parquet(parquets[0]).values
+        ts = read_timeseries_parquet(parquets[0])
         if ts.shape[1] != N_MSDL_REGIONS:
             continue
 
@@ -86,15 +89,23 @@ def load_cpac_timeseries(project_root: Path, data_dir: str | None = None):
     return timeseries, np.array(labels), np.array(sites), subject_ids
 
 
-def run_intersite_cv(timeseries, labels, sites, classifier_name="ridge"):
+def _fold_pipeline(covariances, classifier_name):
     clf = RidgeClassifier() if classifier_name == "ridge" else SVC(kernel="linear")
+    return Pipeline([
+        ("tangent", TangentEmbeddingTransformer(covariances=covariances)),
+        ("classifier", clf),
+    ])
+
+
+def run_intersite_cv(covariances, labels, sites, classifier_name="ridge"):
     logo = LeaveOneGroupOut()
+    subjects = np.arange(len(labels))
     site_results = {}
-    for train_idx, test_idx in logo.split(timeseries, labels, groups=sites):
+    for train_idx, test_idx in logo.split(subjects, labels, groups=sites):
         test_site = sites[test_idx[0]]
-        pipe = Pipeline([("tangent", TangentEmbeddingTransformer()), ("classifier", clf)])
-        pipe.fit([timeseries[i] for i in train_idx], labels[train_idx])
-        accuracy = pipe.score([timeseries[i] for i in test_idx], labels[test_idx])
+        pipe = _fold_pipeline(covariances, classifier_name)
+        pipe.fit(train_idx, labels[train_idx])
+        accuracy = pipe.score(test_idx, labels[test_idx])
         site_results[test_site] = {
             "accuracy": round(float(accuracy), 6),
             "n_test": int(len(test_idx)),
@@ -112,27 +123,23 @@ def run_intersite_cv(timeseries, labels, sites, classifier_name="ridge"):
     }
 
 
-def run_intrasite_cv(timeseries, labels, sites, classifier_name="ridge"):
-    unique_sites = np.unique(sites)
+def run_intrasite_cv(covariances, labels, sites, classifier_name="ridge"):
     site_results = {}
-    for site in unique_sites:
-        mask = sites == site
-        y = labels[mask]
+    for site, idx in site_indices(sites).items():
+        y = labels[idx]
         if len(y) < 10 or (y == 1).sum() < 5 or (y == 0).sum() < 5:
             continue
-        ts_site = [timeseries[i] for i, m in enumerate(mask) if m]
         sss = StratifiedShuffleSplit(n_splits=100, test_size=0.2, random_state=RANDOM_STATE)
         accs = []
-        for tr_i, te_i in sss.split(ts_site, y):
-            clf = RidgeClassifier() if classifier_name == "ridge" else SVC(kernel="linear")
-            pipe = Pipeline([("tangent", TangentEmbeddingTransformer()), ("classifier", clf)])
-            pipe.fit([ts_site[i] for i in tr_i], y[tr_i])
-            accs.append(pipe.score([ts_site[i] for i in te_i], y[te_i]))
+        for tr_i, te_i in sss.split(idx, y):
+            pipe = _fold_pipeline(covariances, classifier_name)
+            pipe.fit(idx[tr_i], y[tr_i])
+            accs.append(pipe.score(idx[te_i], y[te_i]))
         site_results[site] = {
             "median_accuracy": round(float(np.median(accs)), 6),
             "mean_accuracy": round(float(np.mean(accs)), 6),
             "std_accuracy": round(float(np.std(accs)), 6),
-            "n_subjects": int(mask.sum()),
+            "n_subjects": int(len(idx)),
         }
     medians = [v["median_accuracy"] for v in site_results.values()]
     return {
@@ -155,13 +162,14 @@ def main():
     timeseries, labels, sites, _ = load_cpac_timeseries(root, args.data_dir)
     print(f"\n=== C-PAC Baseline (N={len(timeseries)}) ===", flush=True)
     print(f"  ASD: {(labels == 1).sum()}, TC: {(labels == 0).sum()}, Sites: {len(np.unique(sites))}", flush=True)
+    covariances = subject_covariances(timeseries)
 
     cls_dir = derivatives_connectivity(root, variant="cpac") / "classification"
     cls_dir.mkdir(parents=True, exist_ok=True)
 
     for clf_name in ("ridge", "svc"):
         print(f"\n  Inter-site ({clf_name})...", flush=True)
-        r = run_intersite_cv(timeseries, labels, sites, clf_name)
+        r = run_intersite_cv(covariances, labels, sites, clf_name)
         r["experiment"] = "cpac_baseline"
         r["timestamp"] = datetime.now(timezone.utc).isoformat()
         with open(cls_dir / f"results_intersite_cpac_{clf_name}.json", "w") as f:
@@ -169,7 +177,7 @@ def main():
         print(f"    {r['mean_accuracy']:.1%} (+/- {r['std_accuracy']:.1%})", flush=True)
 
         print(f"  Intra-site ({clf_name})...", flush=True)
-        r = run_intrasite_cv(timeseries, labels, sites, clf_name)
+        r = run_intrasite_cv(covariances, labels, sites, clf_name)
         r["experiment"] = "cpac_baseline"
         r["timestamp"] = datetime.now(timezone.utc).isoformat()
         with open(cls_dir / f"results_intrasite_cpac_{clf_name}.json", "w") as f:
@@ -24,8 +24,7 @@ from datetime import datetime, timezone
 from pathlib import Path
 
 import numpy as np
-import pandas as pd
-from nilearn.datasets import fetch_abide_pcp, fetch_atlas_msdl
+from nilearn.datasets import fetch_abide_pcp
 from nilearn.maskers import NiftiMapsMasker
 from sklearn.linear_model import RidgeClassifier
 from sklearn.model_selection import (
@@ -49,6 +48,8 @@ from _helpers import (
     TangentEmbeddingTransformer,
     derivatives_connectivity,
     fetch_abraham_cv_splits,
+    load_msdl_atlas,
+    read_timeseries_parquet,
     regress_confounds,
 )
 
@@ -78,15 +79,16 @@ def load_cpac_data(data_dir: str | None = None, conn_dir: Path | None = None):
     phenotypic = abide.phenotypic
     print(f"  Total subjects: {len(func_files)}", flush=True)
 
-    atlas = fetch_atlas_msdl()
-    region_labels = list(atlas.labels)
+    atlas_maps, _, region_labels = load_msdl_atlas()
+    # Fit once; PCP images share one grid, so the maps are resampled only
+    # on the first transform() and reused afterwards.
     masker = NiftiMapsMasker(
-        maps_img=atlas.maps,
+        maps_img=atlas_maps,
         standardize="zscore_sample",
         detrend=True,
         low_pass=None,
         high_pass=None,
-    )
+    ).fit()
 
     timeseries_list = []
     labels = []
@@ -116,12 +118,12 @@ def load_cpac_data(data_dir: str | None = None, conn_dir: Path | None = None):
             parquet_dir = conn_dir / sub_label / "ses-1" / "func"
             parquets = list(parquet_dir.glob("*_timeseries.parquet")) if parquet_dir.is_dir() else []
             if parquets:
-                ts = pd.read_parquet(parquets[0]).values
+                ts = read_timeseries_parquet(parquets[0])
                 loaded_from_cache += 1
 
         if ts is None:
             try:
-                ts = masker.fit_transform(func)
+                ts = masker.transform(func)
             except Exception as e:
                 print(f"  WARNING: subject {sub_id} failed: {e}", flush=True)
                 skipped += 1
@@ -41,14 +41,17 @@ _setup_path()
 
 from _helpers import (
     N_MSDL_REGIONS,
+    QC_ANALYSIS_COLUMNS,
     RANDOM_STATE,
     TangentEmbeddingTransformer,
-    bep017_stem,
     derivatives_connectivity,
     eligible_subjects,
     fetch_abraham_cv_splits,
+    load_qc_prescreen,
+    read_timeseries_parquet,
     regress_confounds,
     site_prefix,
+    timeseries_outputs,
 )
 
 
@@ -56,12 +59,16 @@ def load_fmriprep_timeseries(project_root: Path, variant: str = "v1"):
     """Load extracted time series + phenotypic data for all QC-passing subjects."""
     conn_dir = derivatives_connectivity(project_root, variant=variant)
     qc_path = conn_dir / "qc_prescreen.tsv"
-    qc_df = pd.read_csv(qc_path, sep="\t")
+    qc_df = load_qc_prescreen(qc_path, columns=QC_ANALYSIS_COLUMNS)
     qc_pass = qc_df[qc_df["excluded_reason"] == "pass"].copy()
 
-    # Load phenotypic data for age/sex
-    pheno = eligible_subjects(project_root)
-    pheno_lookup = pheno.set_index("participant_id")
+    # Attach phenotypic data for age/sex in one join (drops subjects without it)
+    pheno = eligible_subjects(project_root, columns=["source_subject_id", "age", "sex"])
+    qc_pass = qc_pass.merge(
+        pheno[["participant_id", "source_subject_id", "age", "sex"]],
+        on="participant_id",
+        how="inner",
+    )
 
     timeseries = []
     labels = []
@@ -72,35 +79,24 @@ def load_fmriprep_timeseries(project_root: Path, variant: str = "v1"):
     subject_ids = []
     source_subject_ids = []  # original ABIDE IDs for CV split matching
 
-    for _, row in qc_pass.iterrows():
-        sub_id = row["participant_id"]
-        run_label = row["selected_run"]
-        stem = bep017_stem(sub_id, run_label)
-        ts_path = conn_dir / sub_id / "ses-1" / "func" / f"{stem}_stat-mean_timeseries.parquet"
-
-        if not ts_path.exists():
-            continue
-
-        ts = pd.read_parquet(ts_path).values
-        if ts.shape[1] != N_MSDL_REGIONS:
-            continue
-
-        # Get phenotypic info
-        if sub_id not in pheno_lookup.index:
+    for row in qc_pass.itertuples(index=False):
+        sub_id = row.participant_id
+        ts = read_timeseries_parquet(
+            timeseries_outputs(sub_id, row.selected_run, conn_dir)["timeseries"]
+        )
+        if ts is None or ts.shape[1] != N_MSDL_REGIONS:
             continue
-        p = pheno_lookup.loc[sub_id]
 
         timeseries.append(ts)
-        labels.append(1 if row["group"] == "ASD" else 0)
-        sites.append(f"{row['source_dataset']}_{row['source_site']}")
-        datasets.append(row["source_dataset"])
+        labels.append(1 if row.group == "ASD" else 0)
+        sites.append(f"{row.source_dataset}_{row.source_site}")
+        datasets.append(row.source_dataset)
         subject_ids.append(sub_id)
-        source_subject_ids.append(int(p["source_subject_id"]))
+        source_subject_ids.append(int(row.source_subject_id))
 
         # Age and sex (with fallback for missing)
-        age = float(p["age"]) if pd.notna(p.get("age")) else 25.0
-        sex_val = p.get("sex", "M")
-        sex = 1 if sex_val == "M" else 2
+        age = float(row.age) if pd.notna(row.age) else 25.0
+        sex = 1 if row.sex == "M" else 2
         ages.append(age)
         sexes.append(sex)
 
@@ -44,6 +44,8 @@ from _helpers import (
     derivatives_fmriprep,
     fetch_abraham_cv_splits,
     find_confounds,
+    load_participants,
+    read_timeseries_parquet,
     regress_confounds,
     software_versions,
 )
@@ -65,9 +67,12 @@ def main():
     print(f"  {len(cv_splits)} subjects", flush=True)
 
     # Map source_subject_id → participant_id
-    pheno = pd.read_csv(root / "inputs" / "abide-both" / "participants.tsv", sep="\t")
+    pheno = load_participants(root, columns=[
+        "participant_id", "source_dataset", "source_site", "source_subject_id",
+        "group", "age", "sex",
+    ])
     a1 = pheno[pheno["source_dataset"] == "abide1"]
-    sid_to_row = {int(r["source_subject_id"]): r for _, r in a1.iterrows()}
+    sid_to_row = {int(r.source_subject_id): r for r in a1.itertuples(index=False)}
 
     # Read parquets from the source variant dataset
     source_dir = derivatives_connectivity(root, variant=args.source_variant)
@@ -87,8 +92,8 @@ def main():
             missing += 1
             continue
 
-        pid = row["participant_id"]
-        group = row["group"]
+        pid = row.participant_id
+        group = row.group
         if group not in ("ASD", "TC"):
             missing += 1
             continue
@@ -100,16 +105,16 @@ def main():
             missing += 1
             continue
 
-        ts = pd.read_parquet(parquets[0]).values
+        ts = read_timeseries_parquet(parquets[0])
         if ts.shape[1] != N_MSDL_REGIONS:
             missing += 1
             continue
 
         timeseries.append(ts)
         labels.append(1 if group == "ASD" else 0)
-        site_labels.append(str(row["source_site"]))
-        age_values.append(float(row["age"]) if pd.notna(row.get("age")) else 25.0)
-        sex_values.append(1 if row.get("sex") == "M" else 2)
+        site_labels.append(str(row.source_site))
+        age_values.append(float(row.age) if pd.notna(row.age) else 25.0)
+        sex_values.append(1 if row.sex == "M" else 2)
         fold_values.append(fold_idx)
         matched += 1
 
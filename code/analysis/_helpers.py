@@ -2,19 +2,32 @@
 
 from __future__ import annotations
 
+import gzip
+import hashlib
 import io
 import json
+import os
 import re
+import shutil
 import zipfile
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from functools import lru_cache
 from pathlib import Path
 from urllib.request import urlopen
 
 import h5py
+import nibabel as nib
 import nilearn
 import numpy as np
 import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
 import sklearn
 from nilearn.connectome import ConnectivityMeasure
+from nilearn.connectome.connectivity_matrices import _geometric_mean, _map_eigenvalues
+from nilearn.datasets import fetch_atlas_msdl, get_data_dirs
+from nilearn.image import resample_to_img
 from sklearn.base import BaseEstimator, TransformerMixin
 from sklearn.covariance import LedoitWolf
 from sklearn.linear_model import LinearRegression
@@ -57,8 +70,13 @@ LOW_PASS = 0.1
 # --------------------------------------------------------------------------- #
 
 
+@lru_cache(maxsize=1)
 def project_root() -> Path:
-    """Return the project root (two levels up from code/analysis/)."""
+    """Return the project root (two levels up from code/analysis/).
+
+    Resolved once per process: ``resolve()`` stats every path component and
+    every default-rooted path helper goes through here.
+    """
     return Path(__file__).resolve().parent.parent.parent
 
 
@@ -90,6 +108,92 @@ def exclusions_tsv(root: Path | None = None) -> Path:
     return (root or project_root()) / "lists" / "exclusions.tsv"
 
 
+# --------------------------------------------------------------------------- #
+# Atlas
+# --------------------------------------------------------------------------- #
+
+
+@lru_cache(maxsize=1)
+def load_msdl_atlas():
+    """Fetch and load the MSDL atlas once per process.
+
+    Returns ``(maps_path, maps_img, region_labels)`` where ``maps_path`` is
+    the 4D probabilistic maps file, ``maps_img`` the loaded NIfTI image and
+    ``region_labels`` a tuple of the 39 region names.
+    """
+    atlas = fetch_atlas_msdl()
+    return atlas.maps, nib.load(atlas.maps), tuple(atlas.labels)
+
+
+# Voxels per tile in compute_atlas_coverage: 1024 x 39 floats is at most
+# ~300 KB, so each tile stays in L2 between its abs(), sum and dot product.
+_COVERAGE_BLOCK = 1024
+
+
+def compute_atlas_coverage(mask_img, atlas_maps_img) -> np.ndarray:
+    """Compute per-region coverage of BOLD mask over MSDL atlas.
+
+    Coverage is the fraction of each map's absolute weight that falls inside
+    the mask.  All regions are reduced together, streaming the 4D weights in
+    cache-sized voxel tiles instead of materializing ``abs()`` of the whole
+    atlas.  Maps already on the mask grid (as returned by
+    :func:`msdl_atlas_on_grid`) are used as they are.
+    """
+    atlas_resampled = atlas_maps_img
+    if atlas_maps_img.shape[:3] != mask_img.shape[:3] or not np.allclose(
+        atlas_maps_img.affine, mask_img.affine
+    ):
+        atlas_resampled = resample_to_img(
+            atlas_maps_img, mask_img, interpolation="continuous"
+        )
+    # Native dtype (float32 maps): no float64 copy of the 4D atlas, and half
+    # the bytes streamed through the loop below
+    data = np.asanyarray(atlas_resampled.dataobj)
+    # Flatten the spatial axes in memory order so both reshapes are views
+    order = "F" if data.flags.f_contiguous else "C"
+    weights = data.reshape(-1, data.shape[-1], order=order)
+    mask = np.asanyarray(mask_img.dataobj).astype(bool).reshape(-1, order=order)
+    mask = mask.astype(weights.dtype)
+
+    total = np.zeros(weights.shape[1])
+    inside = np.zeros(weights.shape[1])
+    buffer = np.empty((_COVERAGE_BLOCK, weights.shape[1]), dtype=weights.dtype)
+    for start in range(0, len(weights), _COVERAGE_BLOCK):
+        stop = min(start + _COVERAGE_BLOCK, len(weights))
+        tile = np.abs(weights[start:stop], out=buffer[:stop - start])
+        total += tile.sum(axis=0, dtype=np.float64)
+        inside += mask[start:stop] @ tile
+    return np.divide(inside, total, out=np.zeros_like(total), where=total > 0)
+
+
+def msdl_atlas_on_grid(ref_img, cache_dir: Path | None = None):
+    """Return the MSDL maps resampled to the voxel grid of ``ref_img``.
+
+    Only a handful of distinct MNI grids occur across ABIDE sites, so the
+    resampled maps are stored under ``cache_dir`` (default: nilearn's data
+    directory) keyed by grid shape and affine, and re-used by later subjects
+    and processes.  Passing the result to ``NiftiMapsMasker`` means the masker
+    finds maps and data on the same grid and does not resample them again.
+    The cache is an uncompressed ``.nii`` so later loads memory-map it instead
+    of inflating the 4D maps each time (see :func:`decompressed_nifti`).
+    """
+    shape = tuple(int(n) for n in ref_img.shape[:3])
+    affine = np.asarray(ref_img.affine, dtype=np.float64)
+    key = hashlib.sha1(repr(shape).encode() + affine.round(6).tobytes()).hexdigest()[:12]
+    cache_dir = Path(cache_dir or get_data_dirs()[0]) / "msdl_atlas" / "resampled"
+    cached = cache_dir / f"atlas-MSDL_grid-{key}_probseg.nii"
+    if cached.exists():
+        return nib.load(cached)
+
+    _, maps_img, _ = load_msdl_atlas()
+    resampled = resample_to_img(maps_img, ref_img, interpolation="continuous")
+    cache_dir.mkdir(parents=True, exist_ok=True)
+    tmp = cached.with_name(f".{os.getpid()}_{cached.name}")
+    nib.save(resampled, tmp)
+    os.replace(tmp, cached)  # atomic: concurrent jobs never see a partial file
+    return resampled
+
+
 # --------------------------------------------------------------------------- #
 # Subject / run discovery
 # --------------------------------------------------------------------------- #
@@ -103,6 +207,7 @@ _CONFOUNDS_RE = re.compile(
     r"_(?P<run>run-\d+)"
     r"_desc-confounds_timeseries\.tsv$"
 )
+_CONFOUNDS_SUFFIX = "_desc-confounds_timeseries.tsv"
 
 
 def find_confounds(
@@ -116,18 +221,22 @@ def find_confounds(
 
     Sorted by run label (run-1 first).
     """
-    fdir = (fmriprep_dir or derivatives_fmriprep()) / subject_id / "ses-1" / "func"
+    fdir = (fmriprep_dir or derivatives_fmriprep()).joinpath(subject_id, "ses-1", "func")
     results = []
     if not fdir.is_dir():
         return results
-    for fp in sorted(fdir.iterdir()):
-        m = _CONFOUNDS_RE.match(fp.name)
+    # Cheap suffix test first: only confounds TSVs reach the regex
+    names = sorted(
+        name for name in os.listdir(fdir) if name.endswith(_CONFOUNDS_SUFFIX)
+    )
+    for name in names:
+        m = _CONFOUNDS_RE.match(name)
         if m:
             acq = m.group("acq")
             run = m.group("run")
             # Composite label preserving the acq- entity for path reconstruction
             label = f"{acq}_{run}" if acq else run
-            results.append((label, fp))
+            results.append((label, fdir / name))
     return results
 
 
@@ -165,6 +274,38 @@ def get_tr(confounds_path: Path) -> float:
         return float(json.load(f)["RepetitionTime"])
 
 
+def confounds_columns(confounds_path: Path) -> list[str]:
+    """Return the column names of a confounds TSV without parsing its body."""
+    with open(confounds_path) as f:
+        return f.readline().rstrip("\r\n").split("\t")
+
+
+@contextmanager
+def decompressed_nifti(path: Path, scratch_dir: Path | None = None):
+    """Yield an uncompressed ``.nii`` copy of ``path`` inside ``scratch_dir``.
+
+    nilearn re-inflates ``.nii.gz`` inputs on every access, so a BOLD series
+    touched by several loaders is gunzipped several times.  Inflating once to
+    scratch makes the later reads plain file reads.  If ``scratch_dir`` is
+    ``None`` or ``path`` is not gzipped, ``path`` is yielded unchanged.  The
+    scratch copy is removed on exit.
+    """
+    path = Path(path)
+    if scratch_dir is None or not path.name.endswith(".nii.gz"):
+        yield path
+        return
+
+    scratch_dir = Path(scratch_dir)
+    scratch_dir.mkdir(parents=True, exist_ok=True)
+    out_path = scratch_dir / f"{os.getpid()}_{path.name[:-3]}"
+    try:
+        with gzip.open(path, "rb") as src, open(out_path, "wb") as dst:
+            shutil.copyfileobj(src, dst, 1 << 20)
+        yield out_path
+    finally:
+        out_path.unlink(missing_ok=True)
+
+
 # --------------------------------------------------------------------------- #
 # BEP017 output naming
 # --------------------------------------------------------------------------- #
@@ -186,39 +327,348 @@ def output_dir(
     connectivity_dir: Path | None = None,
 ) -> Path:
     """Return the per-subject BEP017 output directory."""
-    d = (connectivity_dir or derivatives_connectivity()) / subject_id / "ses-1" / "func"
+    d = (connectivity_dir or derivatives_connectivity()).joinpath(subject_id, "ses-1", "func")
     d.mkdir(parents=True, exist_ok=True)
     return d
 
 
+#: Keys of :func:`timeseries_outputs` written by the extraction step.
+EXTRACTION_OUTPUTS = ("timeseries", "sidecar", "coverage", "pearson")
+
+
+def timeseries_outputs(
+    subject_id: str,
+    run_label: str,
+    connectivity_dir: Path | None = None,
+) -> dict[str, Path]:
+    """Return the per-run BEP017 output paths (nothing is created).
+
+    The stem and directory are built once; extraction writes everything but
+    ``tangent``, which 03_build_connectomes.py adds.
+    """
+    d = (connectivity_dir or derivatives_connectivity()).joinpath(subject_id, "ses-1", "func")
+    stem = bep017_stem(subject_id, run_label)
+    return {
+        "timeseries": d / f"{stem}_stat-mean_timeseries.parquet",
+        "sidecar": d / f"{stem}_stat-mean_timeseries.json",
+        "coverage": d / f"{stem}_stat-coverage_bold.tsv",
+        "pearson": d / f"{stem}_stat-pearsoncorrelation_relmat.h5",
+        "tangent": d / f"{stem}_stat-tangent_relmat.h5",
+    }
+
+
+def group_covariance_outputs(connectivity_dir: Path | None = None) -> dict[str, Path]:
+    """Return the group-level covariance cache paths (nothing is created)."""
+    d = (connectivity_dir or derivatives_connectivity()) / "group"
+    return {
+        "covariances": d / "group_atlas-MSDL_stat-covariance_relmat.npy",
+        "participants": d / "group_atlas-MSDL_stat-covariance_participants.npy",
+    }
+
+
+def save_group_covariances(
+    covariances: np.ndarray,
+    participant_ids,
+    connectivity_dir: Path | None = None,
+) -> dict[str, Path]:
+    """Write the covariance cache read by :func:`load_group_covariances`.
+
+    Each array is streamed straight into its ``.npy`` file (no in-memory or
+    on-disk staging copy) under a temporary name and then renamed, so a
+    concurrent reader never memory-maps a partially written file.
+    """
+    paths = group_covariance_outputs(connectivity_dir)
+    arrays = {
+        "covariances": np.ascontiguousarray(covariances),
+        "participants": np.asarray(participant_ids, dtype=str),
+    }
+    for key, path in paths.items():
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = path.with_name(f".{os.getpid()}_{path.name}")
+        with open(tmp, "wb") as f:
+            np.lib.format.write_array(f, arrays[key], allow_pickle=False)
+        os.replace(tmp, path)
+    return paths
+
+
+def load_group_covariances(
+    connectivity_dir: Path | None = None,
+    inputs=(),
+) -> tuple[np.ndarray, list[str]] | None:
+    """Memory-map the per-subject covariances saved by 03_build_connectomes.py.
+
+    Returns ``(covariances, participant_ids)``, or None when the cache is
+    missing or older than any existing path in ``inputs``.
+    """
+    paths = group_covariance_outputs(connectivity_dir)
+    if not all(p.exists() for p in paths.values()):
+        return None
+    built = min(p.stat().st_mtime_ns for p in paths.values())
+    if any(p.exists() and p.stat().st_mtime_ns > built for p in inputs):
+        return None
+    return (
+        np.load(paths["covariances"], mmap_mode="r"),
+        np.load(paths["participants"]).tolist(),
+    )
+
+
+def write_timeseries_parquet(path: Path, timeseries: np.ndarray, region_labels) -> None:
+    """Write a (T, R) time-series array as a ``stat-mean_timeseries`` parquet.
+
+    Columns go straight from a Fortran-ordered copy into Arrow arrays (no
+    pandas frame in between), as one row group without dictionary encoding
+    or statistics, which float signals never benefit from.
+    """
+    columns = np.asfortranarray(timeseries)
+    table = pa.Table.from_arrays(
+        [pa.array(columns[:, j]) for j in range(columns.shape[1])],
+        names=[str(label) for label in region_labels],
+    )
+    pq.write_table(
+        table, path,
+        row_group_size=max(1, len(columns)),
+        compression="zstd",
+        compression_level=3,
+        use_dictionary=False,
+        write_statistics=False,
+    )
+
+
+def write_coverage_tsv(path: Path, region_labels, coverage) -> None:
+    """Write the per-region ``stat-coverage_bold`` table (``region``, ``coverage``).
+
+    39 rows do not warrant a DataFrame; values are written with ``repr`` so
+    the file matches what ``DataFrame.to_csv`` produced.
+    """
+    rows = "".join(
+        f"{label}\t{float(value)!r}\n" for label, value in zip(region_labels, coverage)
+    )
+    Path(path).write_text("region\tcoverage\n" + rows)
+
+
+def read_timeseries_parquet(path: Path, columns=None) -> np.ndarray | None:
+    """Load a ``stat-mean_timeseries`` parquet as a (T, R) array (None if absent).
+
+    Reads through pyarrow directly, copying each region column once into the
+    output array rather than building a pandas frame first.  ``columns``
+    restricts the regions read.
+    """
+    if not path.exists():
+        return None
+    table = pq.read_table(path, columns=columns)
+    dtype = np.result_type(*(field.type.to_pandas_dtype() for field in table.schema))
+    timeseries = np.empty((table.num_rows, table.num_columns), dtype=dtype)
+    for j, column in enumerate(table.columns):
+        timeseries[:, j] = column.to_numpy()
+    return timeseries
+
+
+def read_timeseries_many(paths, max_workers: int | None = None) -> list:
+    """Read many parquet time series concurrently, preserving input order.
+
+    Parquet reads release the GIL, so a thread pool overlaps the I/O of the
+    hundreds of small per-subject files.  HDF5 (h5py) reads and writes are
+    not thread-safe and must stay serial.
+    """
+    if max_workers is None:
+        max_workers = min(32, (os.cpu_count() or 1) * 2)
+    with ThreadPoolExecutor(max_workers=max_workers) as pool:
+        return list(pool.map(read_timeseries_parquet, paths))
+
+
+def write_relmat_h5(path: Path, matrix: np.ndarray, region_labels, measure: str,
+                    **attrs) -> None:
+    """Write one ``_relmat.h5`` connectivity matrix with its BEP017 attributes.
+
+    The matrix is stored as float32 (correlations and tangent values carry
+    well under float32 precision) in a contiguous dataset: a 39x39 matrix
+    does not compress, so there is no chunk index or gzip filter.  Extra
+    keyword arguments become dataset attributes.
+    """
+    with h5py.File(path, "w", libver="latest") as hf:
+        ds = hf.create_dataset("matrix", data=np.ascontiguousarray(matrix, dtype=np.float32))
+        ds.attrs["dtype"] = "float32"
+        ds.attrs["regions"] = np.asarray(region_labels, dtype=h5py.string_dtype())
+        ds.attrs["measure"] = measure
+        ds.attrs["atlas"] = "MSDL"
+        ds.attrs["n_regions"] = N_MSDL_REGIONS
+        for key, value in attrs.items():
+            ds.attrs[key] = value
+
+
+def write_sidecar_json(path: Path, sidecar: dict) -> None:
+    """Write an extraction sidecar atomically (temporary file, then rename).
+
+    Write it after every other output of the run: :func:`current_sidecar`
+    trusts the outputs whenever the sidecar and its fingerprint are present,
+    so the sidecar acts as the commit marker for the whole set.
+    """
+    tmp = path.with_suffix(".json.tmp")
+    with open(tmp, "w") as f:
+        json.dump(sidecar, f, indent=2)
+    os.replace(tmp, path)
+
+
+# --------------------------------------------------------------------------- #
+# Extraction fingerprints
+# --------------------------------------------------------------------------- #
+
+
+def input_fingerprint(paths, **params) -> str:
+    """Return a short hash identifying the inputs of an extraction.
+
+    Each file contributes its git-annex key when it is an annex symlink
+    (content-addressed, so stable across clones and re-fetches), otherwise
+    its size and mtime; missing files hash as such.  Keyword ``params``
+    (variant, confound settings, software versions, ...) are hashed alongside.
+    """
+    h = hashlib.sha1()
+    for path in paths:
+        path = Path(path)
+        if path.is_symlink():
+            ident = os.path.basename(os.readlink(path))
+        elif path.exists():
+            st = path.stat()
+            ident = f"{st.st_size}:{st.st_mtime_ns}"
+        else:
+            ident = "missing"
+        h.update(f"{path.name}={ident}\n".encode())
+    h.update(json.dumps(params, sort_keys=True, default=str).encode())
+    return h.hexdigest()[:16]
+
+
+def extraction_params(variant: str, run_label: str) -> dict:
+    """Settings that, together with the input files, determine extraction outputs."""
+    return {
+        "variant": variant,
+        "run": run_label,
+        "space": SPACE,
+        "confounds": [
+            list(CONFOUND_STRATEGY),
+            CONFOUND_MOTION,
+            CONFOUND_COMPCOR,
+            CONFOUND_N_COMPCOR,
+        ],
+        "low_pass": LOW_PASS,
+        "software": software_versions(),
+    }
+
+
+def read_sidecar(sidecar_path: Path) -> dict | None:
+    """Load a JSON sidecar, returning None if it is missing or unreadable."""
+    try:
+        with open(sidecar_path) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def current_sidecar(outputs: dict[str, Path], fingerprint: str) -> dict | None:
+    """Return the recorded sidecar if all ``outputs`` exist and match ``fingerprint``.
+
+    ``outputs`` is the mapping returned by :func:`timeseries_outputs`; only
+    the extraction outputs are checked (the tangent relmat comes later).
+    """
+    # One directory scan instead of a stat() per output; is_file() only
+    # stats symlinks, so an annexed file whose content is absent still counts
+    # as missing
+    try:
+        with os.scandir(outputs["sidecar"].parent) as entries:
+            present = {entry.name for entry in entries if entry.is_file()}
+    except FileNotFoundError:
+        return None
+    if not all(outputs[key].name in present for key in EXTRACTION_OUTPUTS):
+        return None
+    sidecar = read_sidecar(outputs["sidecar"])
+    if sidecar is None or sidecar.get("InputFingerprint") != fingerprint:
+        return None
+    return sidecar
+
+
 # --------------------------------------------------------------------------- #
 # Subject listing
 # --------------------------------------------------------------------------- #
 
 
-def load_participants(root: Path | None = None):
-    """Load participants.tsv as a pandas DataFrame."""
-    return pd.read_csv(participants_tsv(root), sep="\t")
+#: Categorical participants.tsv columns, read as strings rather than inferred.
+PARTICIPANTS_DTYPES = {
+    "participant_id": str,
+    "source_dataset": str,
+    "source_site": str,
+    "group": str,
+    "sex": str,
+    "handedness": str,
+}
+
+
+@lru_cache(maxsize=8)
+def _read_participants(path: str, mtime_ns: int, columns: tuple | None):
+    # ``mtime_ns`` only keys the cache, so an edited file is parsed again
+    dtype = PARTICIPANTS_DTYPES
+    if columns is not None:
+        dtype = {c: t for c, t in PARTICIPANTS_DTYPES.items() if c in columns}
+    usecols = list(columns) if columns is not None else None
+    return pd.read_csv(path, sep="\t", usecols=usecols, dtype=dtype)
+
+
+def load_participants(root: Path | None = None, columns=None):
+    """Load participants.tsv as a pandas DataFrame.
+
+    If ``columns`` is given, only those columns are parsed.  Parsed tables
+    are cached per (path, mtime, columns); callers get their own copy.
+    """
+    path = participants_tsv(root).resolve()
+    key = tuple(columns) if columns is not None else None
+    return _read_participants(str(path), path.stat().st_mtime_ns, key).copy()
 
 
 def load_exclusions(root: Path | None = None):
     """Load exclusions.tsv as a set of participant_ids."""
-    df = pd.read_csv(exclusions_tsv(root), sep="\t")
+    df = pd.read_csv(
+        exclusions_tsv(root), sep="\t",
+        usecols=["participant_id"], dtype={"participant_id": str},
+    )
     return set(df["participant_id"])
 
 
-def eligible_subjects(root: Path | None = None):
+def eligible_subjects(root: Path | None = None, columns=None):
     """Return a DataFrame of subjects eligible for analysis.
 
     Excludes preprocessing failures and subjects without a diagnostic group.
+    ``columns`` restricts the phenotypic columns loaded (``participant_id``
+    and ``group`` are always included).
     """
-    df = load_participants(root)
+    if columns is not None:
+        columns = list(dict.fromkeys(["participant_id", "group", *columns]))
+    df = load_participants(root, columns=columns)
     excl = load_exclusions(root)
     df = df[~df["participant_id"].isin(excl)]
     df = df[df["group"].isin(["ASD", "TC"])]
     return df.reset_index(drop=True)
 
 
+QC_PRESCREEN_DTYPES = {
+    "participant_id": str,
+    "source_dataset": str,
+    "source_site": str,
+    "group": str,
+    "selected_run": str,
+    "excluded_reason": str,
+}
+
+# What the analysis scripts use to select runs and label subjects
+QC_ANALYSIS_COLUMNS = list(QC_PRESCREEN_DTYPES)
+
+
+def load_qc_prescreen(qc_path: Path, columns=None):
+    """Load a ``qc_prescreen.tsv``, parsing only ``columns`` (default: all)."""
+    dtype = {
+        c: t for c, t in QC_PRESCREEN_DTYPES.items()
+        if columns is None or c in columns
+    }
+    return pd.read_csv(qc_path, sep="\t", usecols=columns, dtype=dtype)
+
+
 # --------------------------------------------------------------------------- #
 # Site prefix extraction
 # --------------------------------------------------------------------------- #
@@ -234,11 +684,92 @@ def site_prefix(subject_id: str) -> str:
     return m.group(1)
 
 
+def site_indices(sites) -> dict:
+    """Map each unique site label to the (sorted) indices of its subjects."""
+    unique_sites, codes = np.unique(np.asarray(sites), return_inverse=True)
+    order = np.argsort(codes, kind="stable")
+    bounds = np.cumsum(np.bincount(codes, minlength=len(unique_sites)))[:-1]
+    return dict(zip(unique_sites, np.split(order, bounds)))
+
+
 # --------------------------------------------------------------------------- #
 # Tangent embedding transformer
 # --------------------------------------------------------------------------- #
 
 
+def subject_covariances(timeseries, assume_centered=False) -> np.ndarray:
+    """LedoitWolf covariance of every subject, stacked as ``(n, R, R)``.
+
+    Per-subject covariances do not depend on the CV split, so they are
+    estimated once and indexed by :class:`TangentEmbeddingTransformer`.
+    Subjects with the same number of volumes are estimated together: one
+    batched product gives the empirical covariances and the shrinkage of
+    :func:`sklearn.covariance.ledoit_wolf_shrinkage` is evaluated
+    elementwise, so each slice equals ``LedoitWolf().fit(ts).covariance_``.
+    """
+    n_regions = timeseries[0].shape[1]
+    diag = np.arange(n_regions)
+    covariances = np.empty((len(timeseries), n_regions, n_regions))
+
+    by_length = {}
+    for i, ts in enumerate(timeseries):
+        by_length.setdefault(len(ts), []).append(i)
+
+    for n_samples, idx in by_length.items():
+        X = np.stack([timeseries[i] for i in idx]).astype(np.float64)
+        if not assume_centered:
+            X -= X.mean(axis=1, keepdims=True)
+        X2 = X ** 2
+        emp_cov = X.transpose(0, 2, 1) @ X / n_samples
+        emp_cov_trace = X2.sum(axis=1) / n_samples
+        mu = emp_cov_trace.sum(axis=1) / n_regions
+        beta_ = (X2.sum(axis=2) ** 2).sum(axis=1)
+        delta_ = (emp_cov ** 2).sum(axis=(1, 2))
+        beta = (beta_ / n_samples - delta_) / (n_regions * n_samples)
+        delta = (
+            delta_ - 2.0 * mu * emp_cov_trace.sum(axis=1) + n_regions * mu ** 2
+        ) / n_regions
+        beta = np.minimum(beta, delta)
+        shrinkage = np.divide(beta, delta, out=np.zeros_like(beta), where=beta != 0)
+
+        shrunk = (1.0 - shrinkage)[:, None, None] * emp_cov
+        shrunk[:, diag, diag] += (shrinkage * mu)[:, None]
+        covariances[idx] = shrunk
+
+    return covariances
+
+
+@lru_cache(maxsize=None)
+def _offdiagonal_index(n_regions: int) -> np.ndarray:
+    """Flat (row-major) indices of the strict lower triangle of an R x R matrix."""
+    rows, cols = np.tril_indices(n_regions, k=-1)
+    index = (rows * n_regions + cols).astype(np.intp)
+    index.flags.writeable = False  # shared by every caller through the cache
+    return index
+
+
+def connectome_vectors(matrices) -> np.ndarray:
+    """Vectorize stacked symmetric ``(..., R, R)`` matrices without the diagonal.
+
+    Same feature order and sqrt(2) scaling as nilearn's
+    ``sym_matrix_to_vec(..., discard_diagonal=True)``, but the off-diagonal
+    entries are gathered in one pass through a cached flat index and scaled
+    in place rather than scaling a full copy of the stack first.
+    """
+    matrices = np.asarray(matrices)
+    n_regions = matrices.shape[-1]
+    flat = matrices.reshape(*matrices.shape[:-2], n_regions * n_regions)
+    vectors = np.take(flat, _offdiagonal_index(n_regions), axis=-1)
+    vectors *= np.sqrt(2.0)
+    return vectors
+
+
+def _logm_spd(matrices: np.ndarray) -> np.ndarray:
+    """Matrix logarithm of stacked SPD matrices with one batched ``eigh``."""
+    eigvals, eigvecs = np.linalg.eigh(matrices)
+    return (eigvecs * np.log(eigvals)[..., None, :]) @ eigvecs.swapaxes(-1, -2)
+
+
 class TangentEmbeddingTransformer(BaseEstimator, TransformerMixin):
     """Sklearn-compatible tangent embedding wrapper.
 
@@ -249,12 +780,41 @@ class TangentEmbeddingTransformer(BaseEstimator, TransformerMixin):
     ----------
     assume_centered : bool
         Passed to :class:`~sklearn.covariance.LedoitWolf`.
+    covariances : ndarray of shape (n, R, R), optional
+        Precomputed per-subject covariances (see :func:`subject_covariances`).
+        When given, ``X`` is an integer index array into it and only the
+        geometric mean and projection are computed per fold.
+    dtype : str or numpy dtype, optional
+        Cast the output features (e.g. ``"float32"`` to halve the memory
+        traffic of the downstream classifier).  Default keeps float64.
+    mean_init : ndarray of shape (R, R), optional
+        Warm start for the geometric-mean iterations (precomputed path only),
+        e.g. the whole-sample mean.  The stopping tolerance is unchanged, so
+        the fold mean converges to the same point in fewer iterations.
     """
 
-    def __init__(self, assume_centered=False):
+    def __init__(self, assume_centered=False, covariances=None, dtype=None,
+                 mean_init=None):
         self.assume_centered = assume_centered
+        self.covariances = covariances
+        self.dtype = dtype
+        self.mean_init = mean_init
+
+    def _indexed(self, X):
+        return self.covariances[np.asarray(X, dtype=np.intp).ravel()]
+
+    def tangent_matrices(self, X) -> np.ndarray:
+        """Full ``(n, R, R)`` tangent matrices of the indexed covariances."""
+        return _logm_spd(self.whitening_ @ self._indexed(X) @ self.whitening_)
 
     def fit(self, X, y=None):
+        if self.covariances is not None:
+            # Same estimate as ConnectivityMeasure(kind="tangent").fit()
+            self.mean_ = _geometric_mean(
+                list(self._indexed(X)), init=self.mean_init, max_iter=30, tol=1e-7
+            )
+            self.whitening_ = _map_eigenvalues(lambda x: 1.0 / np.sqrt(x), self.mean_)
+            return self
         self._conn = ConnectivityMeasure(
             cov_estimator=LedoitWolf(assume_centered=self.assume_centered),
             kind="tangent",
@@ -265,7 +825,13 @@ class TangentEmbeddingTransformer(BaseEstimator, TransformerMixin):
         return self
 
     def transform(self, X):
-        return self._conn.transform(X)
+        if self.covariances is not None:
+            features = connectome_vectors(self.tangent_matrices(X))
+        else:
+            features = self._conn.transform(X)
+        if self.dtype is not None:
+            features = features.astype(self.dtype, copy=False)
+        return features
 
 
 # --------------------------------------------------------------------------- #
@@ -19,9 +19,9 @@ Usage::
     python code/analysis/extract_subject.py \\
         --project-root . --participant-id sub-v1s0x0050642 --variants v1 v2 v3
 
-    # C-PAC (all subjects in one call)
+    # C-PAC (all subjects in one call, 8 worker processes)
     python code/analysis/extract_subject.py \\
-        --project-root . --source cpac --data-dir /path/to/cache
+        --project-root . --source cpac --data-dir /path/to/cache --jobs 8
 """
 
 from __future__ import annotations
@@ -29,18 +29,18 @@ from __future__ import annotations
 import argparse
 import json
 import sys
+from concurrent.futures import ProcessPoolExecutor
 from datetime import datetime, timezone
 from pathlib import Path
 
-import h5py
 import nibabel as nib
 import numpy as np
 import pandas as pd
-from nilearn.datasets import fetch_atlas_msdl
-from nilearn.image import clean_img, resample_to_img
+from nilearn.image import clean_img, get_data
 from nilearn.interfaces.fmriprep import load_confounds
 from nilearn.maskers import NiftiMapsMasker
 from nilearn.signal import clean, high_variance_confounds
+from threadpoolctl import threadpool_limits
 
 
 def _setup_path():
@@ -59,15 +59,27 @@ from _helpers import (
     LOW_PASS,
     N_MSDL_REGIONS,
     SPACE,
-    bep017_stem,
     bold_path_from_confounds,
     brain_mask_from_confounds,
+    compute_atlas_coverage,
+    confounds_columns,
+    current_sidecar,
+    decompressed_nifti,
     derivatives_connectivity,
     derivatives_fmriprep,
+    extraction_params,
     find_confounds,
     get_tr,
+    input_fingerprint,
+    load_msdl_atlas,
+    msdl_atlas_on_grid,
     output_dir,
+    timeseries_outputs,
     software_versions,
+    write_coverage_tsv,
+    write_relmat_h5,
+    write_sidecar_json,
+    write_timeseries_parquet,
 )
 
 VARIANT_DESCRIPTIONS = {
@@ -78,45 +90,30 @@ VARIANT_DESCRIPTIONS = {
 }
 
 
-# --------------------------------------------------------------------------- #
-# Atlas coverage
-# --------------------------------------------------------------------------- #
-
-def compute_atlas_coverage(mask_path, atlas_maps_img):
-    mask_img = nib.load(str(mask_path))
-    atlas_resampled = resample_to_img(atlas_maps_img, mask_img, interpolation="continuous")
-    atlas_data = atlas_resampled.get_fdata()
-    mask_data = mask_img.get_fdata().astype(bool)
-    coverage = np.zeros(N_MSDL_REGIONS)
-    for i in range(N_MSDL_REGIONS):
-        region_map = atlas_data[..., i]
-        total = np.abs(region_map).sum()
-        if total > 0:
-            coverage[i] = np.abs(region_map[mask_data]).sum() / total
-    return coverage
-
-
 # --------------------------------------------------------------------------- #
 # Per-variant extraction functions
 # --------------------------------------------------------------------------- #
+# ``bold_path`` is only used by load_confounds to locate the confounds TSV;
+# voxel data come from ``bold_img``/``mask_img``, loaded once per subject so
+# nibabel's data cache is shared across variants.
 
-def _extract_v1(bold_path, mask_path, conf_path, tr, masker):
+def _extract_v1(bold_path, bold_img, mask_img, conf_path, tr, masker):
     confounds, sample_mask = load_confounds(
         str(bold_path), strategy=CONFOUND_STRATEGY, motion=CONFOUND_MOTION,
         compcor=CONFOUND_COMPCOR, n_compcor=CONFOUND_N_COMPCOR, demean=True,
     )
-    ts = masker.fit_transform(str(bold_path), confounds=confounds, sample_mask=sample_mask)
+    ts = masker.transform(bold_img, confounds=confounds, sample_mask=sample_mask)
     extra = {"ConfoundStrategy": VARIANT_DESCRIPTIONS["v1"], "Confounds": list(CONFOUND_STRATEGY)}
     return ts, extra
 
 
-def _extract_v2(bold_path, mask_path, conf_path, tr, masker):
+def _extract_v2(bold_path, bold_img, mask_img, conf_path, tr, masker):
     confounds, sample_mask = load_confounds(
         str(bold_path), strategy=CONFOUND_STRATEGY, motion=CONFOUND_MOTION,
         compcor=CONFOUND_COMPCOR, n_compcor=CONFOUND_N_COMPCOR, demean=True,
     )
-    bold_data = nib.load(str(bold_path)).get_fdata()
-    mask_data = nib.load(str(mask_path)).get_fdata().astype(bool)
+    bold_data = get_data(bold_img)
+    mask_data = get_data(mask_img).astype(bool)
     voxel_ts = bold_data[mask_data].T
     if sample_mask is not None:
         voxel_ts = voxel_ts[sample_mask]
@@ -125,27 +122,27 @@ def _extract_v2(bold_path, mask_path, conf_path, tr, masker):
                          index=confounds.index if sample_mask is None else confounds.index[sample_mask])
     confounds_combined = pd.concat([confounds, hv_df], axis=1)
     del bold_data, voxel_ts
-    ts = masker.fit_transform(str(bold_path), confounds=confounds_combined, sample_mask=sample_mask)
+    ts = masker.transform(bold_img, confounds=confounds_combined, sample_mask=sample_mask)
     extra = {"ConfoundStrategy": VARIANT_DESCRIPTIONS["v2"],
              "Confounds": list(CONFOUND_STRATEGY) + ["high_variance"],
              "HighVarianceNConfounds": 5, "HighVariancePercentile": 2.0}
     return ts, extra
 
 
-def _extract_v3(bold_path, mask_path, conf_path, tr, atlas):
+def _extract_v3(bold_path, bold_img, mask_img, conf_path, tr, atlas_maps):
     confounds_s1, sample_mask = load_confounds(
         str(bold_path), strategy=CONFOUND_STRATEGY, motion=CONFOUND_MOTION,
         compcor=CONFOUND_COMPCOR, n_compcor=CONFOUND_N_COMPCOR, demean=True,
     )
-    bold_clean = clean_img(str(bold_path), confounds=confounds_s1, low_pass=LOW_PASS,
-                           high_pass=0.01, t_r=tr, detrend=True, mask_img=str(mask_path))
-    masker_clean = NiftiMapsMasker(maps_img=atlas.maps, standardize="zscore_sample",
+    bold_clean = clean_img(bold_img, confounds=confounds_s1, low_pass=LOW_PASS,
+                           high_pass=0.01, t_r=tr, detrend=True, mask_img=mask_img)
+    masker_clean = NiftiMapsMasker(maps_img=atlas_maps, standardize="zscore_sample",
                                    detrend=False, low_pass=None, high_pass=None, t_r=tr)
     ts = masker_clean.fit_transform(bold_clean)
-    conf_tsv = pd.read_csv(conf_path, sep="\t")
-    tcols = sorted([c for c in conf_tsv.columns if c.startswith("t_comp_cor_")])[:CONFOUND_N_COMPCOR]
+    tcols = sorted(c for c in confounds_columns(conf_path) if c.startswith("t_comp_cor_"))[:CONFOUND_N_COMPCOR]
     if tcols:
-        ts = clean(ts, confounds=conf_tsv[tcols].values, detrend=False, standardize="zscore_sample")
+        tcompcor = pd.read_csv(conf_path, sep="\t", usecols=tcols)[tcols].values
+        ts = clean(ts, confounds=tcompcor, detrend=False, standardize="zscore_sample")
     extra = {"ConfoundStrategy": VARIANT_DESCRIPTIONS["v3"],
              "Stage1Confounds": list(CONFOUND_STRATEGY), "Stage2Confounds": ["temporal_compcor"]}
     return ts, extra
@@ -159,14 +156,16 @@ _EXTRACT_FN = {"v1": _extract_v1, "v2": _extract_v2, "v3": _extract_v3}
 # --------------------------------------------------------------------------- #
 
 def write_outputs(ts, subject_id, run_label, variant, conn_dir, tr, coverage, region_labels, extra_sidecar):
-    odir = output_dir(subject_id, conn_dir)
-    stem = bep017_stem(subject_id, run_label)
+    output_dir(subject_id, conn_dir)
+    outputs = timeseries_outputs(subject_id, run_label, conn_dir)
+    # Drop any previous sidecar first, so an interrupted rewrite never leaves
+    # a sidecar that vouches for half-replaced outputs.
+    outputs["sidecar"].unlink(missing_ok=True)
 
     # Parquet
-    pd.DataFrame(ts, columns=region_labels).to_parquet(
-        odir / f"{stem}_stat-mean_timeseries.parquet", index=False)
+    write_timeseries_parquet(outputs["timeseries"], ts, region_labels)
 
-    # JSON sidecar
+    # JSON sidecar contents (written last)
     sidecar = {
         "RepetitionTime": tr, "NumberOfVolumes": int(ts.shape[0]),
         "Atlas": "MSDL", "NumberOfRegions": N_MSDL_REGIONS, "Variant": variant,
@@ -179,29 +178,24 @@ def write_outputs(ts, subject_id, run_label, variant, conn_dir, tr, coverage, re
         "SoftwareVersions": software_versions(),
         "Timestamp": datetime.now(timezone.utc).isoformat(),
     }
-    with open(odir / f"{stem}_stat-mean_timeseries.json", "w") as f:
-        json.dump(sidecar, f, indent=2)
-
     # Coverage TSV
-    pd.DataFrame({"region": region_labels, "coverage": coverage}).to_csv(
-        odir / f"{stem}_stat-coverage_bold.tsv", sep="\t", index=False)
+    write_coverage_tsv(outputs["coverage"], region_labels, coverage)
 
     # Pearson correlation HDF5
     corr = np.corrcoef(ts.T)
-    with h5py.File(odir / f"{stem}_stat-pearsoncorrelation_relmat.h5", "w") as hf:
-        ds = hf.create_dataset("matrix", data=corr, compression="gzip")
-        ds.attrs["regions"] = region_labels
-        ds.attrs["measure"] = "pearson_correlation"
-        ds.attrs["atlas"] = "MSDL"
-        ds.attrs["n_regions"] = N_MSDL_REGIONS
-        ds.attrs["tr"] = tr
+    write_relmat_h5(outputs["pearson"], corr, region_labels, "pearson_correlation", tr=tr)
+
+    # Sidecar last: it marks the whole output set as current
+    write_sidecar_json(outputs["sidecar"], sidecar)
 
 
 # --------------------------------------------------------------------------- #
 # fMRIPrep extraction (per subject, multiple variants)
 # --------------------------------------------------------------------------- #
 
-def extract_fmriprep_subject(subject_id, project_root, variants, run_label=None):
+
+def extract_fmriprep_subject(subject_id, project_root, variants, run_label=None, scratch_dir=None,
+                             overwrite=False):
     fmriprep_dir = derivatives_fmriprep(project_root)
 
     runs = find_confounds(subject_id, fmriprep_dir)
@@ -225,6 +219,23 @@ def extract_fmriprep_subject(subject_id, project_root, variants, run_label=None)
 
     bold = bold_path_from_confounds(conf_path)
     mask = brain_mask_from_confounds(conf_path)
+
+    # Skip variants whose outputs are complete and were produced from identical
+    # inputs, before staging checks, atlas fetch or any NIfTI/confounds load.
+    fingerprints = {}
+    pending = []
+    for variant in variants:
+        fingerprints[variant] = input_fingerprint(
+            (bold, mask, conf_path), **extraction_params(variant, selected_run))
+        outputs = timeseries_outputs(subject_id, selected_run,
+                                     derivatives_connectivity(project_root, variant=variant))
+        if not overwrite and current_sidecar(outputs, fingerprints[variant]) is not None:
+            print(f"  {subject_id} {variant}: up to date, skipping", flush=True)
+        else:
+            pending.append(variant)
+    if not pending:
+        return
+
     if not bold.exists():
         print(f"  SKIP: {subject_id} -- BOLD not available (needs datalad get)", flush=True)
         return
@@ -233,40 +244,102 @@ def extract_fmriprep_subject(subject_id, project_root, variants, run_label=None)
         return
 
     tr = get_tr(conf_path)
-    atlas = fetch_atlas_msdl()
-    atlas_maps_img = nib.load(atlas.maps)
-    region_labels = list(atlas.labels)
+    region_labels = list(load_msdl_atlas()[2])
 
-    # Coverage (shared across variants)
-    coverage = compute_atlas_coverage(mask, atlas_maps_img)
+    # Inflate BOLD + mask once to scratch (no-op without --decompress-scratch);
+    # load_confounds still needs the original BOLD path to find the TSV.
+    with decompressed_nifti(bold, scratch_dir) as bold_input, \
+            decompressed_nifti(mask, scratch_dir) as mask_input:
+        bold_img = nib.load(str(bold_input))
+        mask_img = nib.load(str(mask_input))
 
-    # Build masker for v1/v2
-    masker = NiftiMapsMasker(maps_img=atlas.maps, standardize="zscore_sample",
-                             detrend=False, low_pass=LOW_PASS, high_pass=None, t_r=tr)
+        # MSDL maps on this subject's grid (cached across subjects sharing it)
+        atlas_maps = msdl_atlas_on_grid(mask_img)
 
-    for variant in variants:
-        conn_dir = derivatives_connectivity(project_root, variant=variant)
-        try:
-            if variant in ("v1", "v2"):
-                ts, extra = _EXTRACT_FN[variant](bold, mask, conf_path, tr, masker)
-            else:  # v3
-                ts, extra = _extract_v3(bold, mask, conf_path, tr, atlas)
+        # Coverage (shared across variants)
+        coverage = compute_atlas_coverage(mask_img, atlas_maps)
+
+        # Build and fit masker once for v1/v2; the variants only call transform()
+        masker = NiftiMapsMasker(maps_img=atlas_maps, standardize="zscore_sample",
+                                 detrend=False, low_pass=LOW_PASS, high_pass=None, t_r=tr).fit()
+
+        for variant in pending:
+            conn_dir = derivatives_connectivity(project_root, variant=variant)
+            try:
+                if variant in ("v1", "v2"):
+                    ts, extra = _EXTRACT_FN[variant](bold, bold_img, mask_img, conf_path, tr, masker)
+                else:  # v3
+                    ts, extra = _extract_v3(bold, bold_img, mask_img, conf_path, tr, atlas_maps)
 
-            if ts.shape[1] != N_MSDL_REGIONS:
-                print(f"  WARN: {subject_id} {variant} -- {ts.shape[1]} regions", flush=True)
-                continue
+                if ts.shape[1] != N_MSDL_REGIONS:
+                    print(f"  WARN: {subject_id} {variant} -- {ts.shape[1]} regions", flush=True)
+                    continue
 
-            write_outputs(ts, subject_id, selected_run, variant, conn_dir, tr, coverage, region_labels, extra)
-            print(f"  {subject_id} {variant}: {ts.shape[0]} volumes, coverage={coverage.mean():.3f}", flush=True)
-        except Exception as e:
-            print(f"  FAIL: {subject_id} {variant}: {e}", flush=True)
+                extra["InputFingerprint"] = fingerprints[variant]
+                write_outputs(ts, subject_id, selected_run, variant, conn_dir, tr, coverage, region_labels, extra)
+                print(f"  {subject_id} {variant}: {ts.shape[0]} volumes, coverage={coverage.mean():.3f}", flush=True)
+            except Exception as e:
+                print(f"  FAIL: {subject_id} {variant}: {e}", flush=True)
 
 
 # --------------------------------------------------------------------------- #
 # C-PAC extraction (all subjects in one call)
 # --------------------------------------------------------------------------- #
 
-def extract_cpac_all(project_root, data_dir=None):
+#: Per-process C-PAC masker (fitted lazily, once per pool worker). All PCP
+#: func_preproc images share one grid, so the maps resampled on the first
+#: transform() are reused for every later subject.
+_CPAC_MASKER = None
+
+
+def _cpac_masker():
+    global _CPAC_MASKER
+    if _CPAC_MASKER is None:
+        atlas_maps, _, _ = load_msdl_atlas()
+        _CPAC_MASKER = NiftiMapsMasker(maps_img=atlas_maps, standardize="zscore_sample",
+                                       detrend=True).fit()
+    return _CPAC_MASKER
+
+
+def _init_cpac_worker():
+    # One BLAS thread per worker so N workers do not oversubscribe N cores
+    threadpool_limits(limits=1)
+    _cpac_masker()
+
+
+def _extract_cpac_subject(task):
+    """Extract and write one PCP subject. Returns ``(sub_label, ok, error)``."""
+    func, sub_label, conn_dir = task
+    try:
+        ts = _cpac_masker().transform(func)
+        if ts.shape[1] != N_MSDL_REGIONS:
+            return sub_label, False, None
+
+        odir_path = conn_dir / sub_label / "ses-1" / "func"
+        odir_path.mkdir(parents=True, exist_ok=True)
+        stem = f"{sub_label}_ses-1_task-rest_run-1_space-MNI152_atlas-MSDL"
+
+        write_timeseries_parquet(
+            odir_path / f"{stem}_stat-mean_timeseries.parquet", ts, load_msdl_atlas()[2])
+
+        sidecar = {
+            "Atlas": "MSDL", "NumberOfRegions": N_MSDL_REGIONS,
+            "NumberOfVolumes": int(ts.shape[0]),
+            "Pipeline": "cpac", "Variant": "cpac",
+            "ConfoundStrategy": VARIANT_DESCRIPTIONS["cpac"],
+            "BandPassFiltering": True, "GlobalSignalRegression": False,
+            "Standardize": "zscore_sample", "Detrend": True,
+            "SoftwareVersions": software_versions(),
+            "Timestamp": datetime.now(timezone.utc).isoformat(),
+        }
+        with open(odir_path / f"{stem}_stat-mean_timeseries.json", "w") as f:
+            json.dump(sidecar, f, indent=2)
+        return sub_label, True, None
+    except Exception as e:
+        return sub_label, False, str(e)
+
+
+def extract_cpac_all(project_root, data_dir=None, jobs=1):
     from nilearn.datasets import fetch_abide_pcp
 
     print("Fetching ABIDE PCP (C-PAC)...", flush=True)
@@ -274,49 +347,28 @@ def extract_cpac_all(project_root, data_dir=None):
                             global_signal_regression=False, derivatives=["func_preproc"],
                             quality_checked=True, verbose=1)
     phenotypic = abide.phenotypic
-    print(f"  {len(abide.func_preproc)} subjects", flush=True)
+    n_subjects = len(abide.func_preproc)
+    print(f"  {n_subjects} subjects ({jobs} job(s))", flush=True)
 
-    atlas = fetch_atlas_msdl()
-    region_labels = list(atlas.labels)
-    masker = NiftiMapsMasker(maps_img=atlas.maps, standardize="zscore_sample", detrend=True)
     conn_dir = derivatives_connectivity(project_root, variant="cpac")
+    tasks = [
+        (func, f"sub-{str(int(phenotypic['SUB_ID'].iloc[i])).zfill(7)}", conn_dir)
+        for i, func in enumerate(abide.func_preproc)
+    ]
 
+    pool = ProcessPoolExecutor(max_workers=jobs, initializer=_init_cpac_worker) if jobs > 1 else None
     extracted = 0
-    for i, func in enumerate(abide.func_preproc):
-        sub_id = str(int(phenotypic["SUB_ID"].iloc[i])).zfill(7)
-        sub_label = f"sub-{sub_id}"
-
-        try:
-            ts = masker.fit_transform(func)
-            if ts.shape[1] != N_MSDL_REGIONS:
-                continue
-
-            odir_path = conn_dir / sub_label / "ses-1" / "func"
-            odir_path.mkdir(parents=True, exist_ok=True)
-            stem = f"{sub_label}_ses-1_task-rest_run-1_space-MNI152_atlas-MSDL"
-
-            pd.DataFrame(ts, columns=region_labels).to_parquet(
-                odir_path / f"{stem}_stat-mean_timeseries.parquet", index=False)
-
-            sidecar = {
-                "Atlas": "MSDL", "NumberOfRegions": N_MSDL_REGIONS,
-                "NumberOfVolumes": int(ts.shape[0]),
-                "Pipeline": "cpac", "Variant": "cpac",
-                "ConfoundStrategy": VARIANT_DESCRIPTIONS["cpac"],
-                "BandPassFiltering": True, "GlobalSignalRegression": False,
-                "Standardize": "zscore_sample", "Detrend": True,
-                "SoftwareVersions": software_versions(),
-                "Timestamp": datetime.now(timezone.utc).isoformat(),
-            }
-            with open(odir_path / f"{stem}_stat-mean_timeseries.json", "w") as f:
-                json.dump(sidecar, f, indent=2)
-
-            extracted += 1
-        except Exception as e:
-            print(f"  FAIL: {sub_label}: {e}", flush=True)
-
-        if (i + 1) % 50 == 0:
-            print(f"  {i + 1}/{len(abide.func_preproc)} ({extracted} extracted)", flush=True)
+    try:
+        results = pool.map(_extract_cpac_subject, tasks, chunksize=1) if pool else map(_extract_cpac_subject, tasks)
+        for i, (sub_label, ok, err) in enumerate(results):
+            if err is not None:
+                print(f"  FAIL: {sub_label}: {err}", flush=True)
+            extracted += ok
+            if (i + 1) % 50 == 0:
+                print(f"  {i + 1}/{n_subjects} ({extracted} extracted)", flush=True)
+    finally:
+        if pool is not None:
+            pool.shutdown()
 
     print(f"  Done: {extracted} extracted", flush=True)
 
@@ -339,13 +391,20 @@ def main():
                         help="Data source (default: fmriprep).")
     parser.add_argument("--data-dir", type=str, default=None,
                         help="Cache directory for PCP downloads (cpac source only).")
+    parser.add_argument("--jobs", type=int, default=1,
+                        help="Parallel worker processes (cpac source only, default: 1).")
+    parser.add_argument("--decompress-scratch", type=Path, default=None, metavar="DIR",
+                        help="Inflate BOLD/mask .nii.gz to DIR once before extraction "
+                             "(fMRIPrep source only).")
+    parser.add_argument("--overwrite", action="store_true",
+                        help="Re-extract even if outputs are up to date (fMRIPrep source only).")
     parser.add_argument("--dry-run", action="store_true",
                         help="Check subject availability without extracting.")
     args = parser.parse_args()
     root = args.project_root.resolve()
 
     if args.source == "cpac":
-        extract_cpac_all(root, data_dir=args.data_dir)
+        extract_cpac_all(root, data_dir=args.data_dir, jobs=args.jobs)
     else:
         if not args.participant_id:
             print("ERROR: --participant-id required for fMRIPrep source", file=sys.stderr, flush=True)
@@ -363,7 +422,8 @@ def main():
                 print(f"{args.participant_id}: no confounds found", flush=True)
             return
 
-        extract_fmriprep_subject(args.participant_id, root, args.variants, run_label=args.run)
+        extract_fmriprep_subject(args.participant_id, root, args.variants, run_label=args.run,
+                                 scratch_dir=args.decompress_scratch, overwrite=args.overwrite)
 
 
 if __name__ == "__main__":
@@ -1,39 +1,42 @@
 #!/usr/bin/env python3
 import argparse
+import csv
 import fnmatch
-import gzip
+import http.client
 import json
 import os
+import re
 import shutil
 import struct
 import subprocess
+import sys
+import threading
+import zlib
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from contextlib import ExitStack
 from datetime import datetime
+from functools import partial
 from pathlib import Path
-from typing import Any, Dict, Iterable, List, Optional, Tuple
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional, Tuple, Union
+from urllib.parse import urlparse
+from urllib.error import HTTPError
+from urllib.request import Request, urlopen
 
 
 def list_sites(dataset_dir: Path) -> List[str]:
-    sites = []
-    for entry in sorted(dataset_dir.iterdir()):
-        if not entry.is_dir():
-            continue
-        name = entry.name
-        if name.startswith("."):
-            continue
-        if name in {".git", ".datalad"}:
-            continue
-        sites.append(name)
-    return sites
+    # Hidden entries include .git and .datalad
+    with os.scandir(dataset_dir) as it:
+        return sorted(
+            entry.name for entry in it if not entry.name.startswith(".") and entry.is_dir()
+        )
 
 
 def list_subjects(site_dir: Path) -> List[Path]:
-    subjects = []
-    for entry in sorted(site_dir.iterdir()):
-        if not entry.is_dir():
-            continue
-        if entry.name.startswith("sub-"):
-            subjects.append(entry)
-    return subjects
+    with os.scandir(site_dir) as it:
+        names = sorted(
+            entry.name for entry in it if entry.name.startswith("sub-") and entry.is_dir()
+        )
+    return [site_dir / name for name in names]
 
 
 def run_cmd(
@@ -70,67 +73,121 @@ def annex_get(repo_dir: Path, relpath: Path, dry_run: bool) -> None:
     run_cmd(cmd, cwd=repo_dir, dry_run=dry_run)
 
 
-def annex_drop(repo_dir: Path, relpath: Path, dry_run: bool, force: bool) -> None:
-    cmd = ["git", "annex", "drop", str(relpath)]
-    if force:
-        cmd.insert(3, "--force")
+# Precompiled NIfTI-1 header fields: sizeof_hdr (offset 0) and pixdim[4], the
+# TR (offset 76 + 4 * 4).
+_NIFTI_INT32_LE = struct.Struct("<i")
+_NIFTI_INT32_BE = struct.Struct(">i")
+_NIFTI_FLOAT32_LE = struct.Struct("<f")
+_NIFTI_FLOAT32_BE = struct.Struct(">f")
+_NIFTI_TR_OFFSET = 92
+# xyzt_units time codes (bits 3..5) to seconds: 8=sec, 16=msec, 24=usec.
+_NIFTI_TIME_UNIT_SECONDS = {8: 1.0, 16: 0.001, 24: 1e-6}
 
-    if dry_run:
-        run_cmd(cmd, cwd=repo_dir, dry_run=True)
-        return
 
-    # Drop is a best-effort cleanup: if it fails (e.g., no known copies),
-    # keep the file rather than failing the whole build.
-    try:
-        subprocess.run(cmd, cwd=str(repo_dir), check=True)
-    except subprocess.CalledProcessError as e:
-        print(f"[WARN] git-annex drop failed for {repo_dir}/{relpath}: {e}")
+def gunzip_prefix(path: Path, nbytes: int, chunk_size: int = 1024) -> bytes:
+    """Inflate only the first ``nbytes`` of a gzip file.
+
+    Reads the compressed stream in small chunks and stops as soon as enough
+    output is available, instead of setting up a full GzipFile buffer.
+    """
+    decomp = zlib.decompressobj(16 + zlib.MAX_WBITS)
+    out = b""
+    with open(path, "rb") as f:
+        while len(out) < nbytes:
+            raw = f.read(chunk_size)
+            if not raw:
+                break
+            out += decomp.decompress(raw, nbytes - len(out))
+    return out
 
 
 def nifti_tr_seconds(nifti_path: Path) -> float:
     """Extract TR from a NIfTI-1 header (nii or nii.gz) in seconds."""
 
     if nifti_path.name.endswith(".nii.gz"):
-        opener = gzip.open
+        hdr = gunzip_prefix(nifti_path, 348)
     elif nifti_path.name.endswith(".nii"):
-        opener = open
+        with open(nifti_path, "rb") as f:
+            hdr = f.read(348)
     else:
         raise ValueError(f"Not a NIfTI file: {nifti_path}")
+    return nifti_header_tr_seconds(hdr, str(nifti_path))
 
-    with opener(nifti_path, "rb") as f:
-        hdr = f.read(348)
-    if len(hdr) != 348:
-        raise ValueError(f"Short NIfTI header ({len(hdr)} bytes): {nifti_path}")
 
-    sizeof_hdr_le = struct.unpack("<i", hdr[0:4])[0]
-    if sizeof_hdr_le == 348:
-        endian = "<"
+def nifti_header_tr_seconds(hdr: bytes, source: str) -> float:
+    """Extract TR in seconds from the first 348 bytes of a NIfTI-1 file."""
+    if len(hdr) < 348:
+        raise ValueError(f"Short NIfTI header ({len(hdr)} bytes): {source}")
+
+    if _NIFTI_INT32_LE.unpack_from(hdr, 0)[0] == 348:
+        float_struct = _NIFTI_FLOAT32_LE
+    elif _NIFTI_INT32_BE.unpack_from(hdr, 0)[0] == 348:
+        float_struct = _NIFTI_FLOAT32_BE
     else:
-        sizeof_hdr_be = struct.unpack(">i", hdr[0:4])[0]
-        if sizeof_hdr_be != 348:
-            raise ValueError(f"Not a NIfTI-1 header (sizeof_hdr != 348): {nifti_path}")
-        endian = ">"
+        raise ValueError(f"Not a NIfTI-1 header (sizeof_hdr != 348): {source}")
 
-    pixdim = struct.unpack(f"{endian}8f", hdr[76:108])
-    tr = float(pixdim[4])
+    tr = float(float_struct.unpack_from(hdr, _NIFTI_TR_OFFSET)[0])
 
-    # xyzt_units is a bitfield. Time units are in bits 3..5.
-    # 8=sec, 16=msec, 24=usec (combined with spatial units in bits 0..2).
+    # xyzt_units is a bitfield: time units in bits 3..5, combined with
+    # spatial units in bits 0..2.
     xyzt_units = hdr[123]
     time_unit = xyzt_units & 0x38
-    factor = {8: 1.0, 16: 0.001, 24: 1e-6}.get(time_unit, 1.0)
+    factor = _NIFTI_TIME_UNIT_SECONDS.get(time_unit, 1.0)
     tr_sec = tr * factor
     if tr_sec <= 0:
-        raise ValueError(f"Invalid TR extracted ({tr_sec}) from {nifti_path}")
+        raise ValueError(f"Invalid TR extracted ({tr_sec}) from {source}")
     return tr_sec
 
 
+# Hosts that answered a Range request with the full body, refused it, or could
+# not be reached; not retried in this process. Without outbound network every
+# host fails once, then the annex get fallback runs without further waiting.
+_NO_RANGE_HOSTS: set = set()
+# Seconds to wait for a connection (and each read); a header is a few KB.
+_RANGE_TIMEOUT = 5
+
+
+def remote_nifti_tr_seconds(urls: List[str], name: str, nbytes: int = 4096) -> Optional[float]:
+    """Read TR from the first ``nbytes`` of a remote NIfTI via an HTTP Range request.
+
+    Tries each URL until one answers ``206 Partial Content`` with a parseable
+    header, so the TR costs a few KB instead of an ``annex get`` of the whole
+    BOLD series. Returns None if no URL serves a usable range.
+    """
+    for url in urls:
+        host = urlparse(url).netloc
+        if not url.startswith(("http://", "https://")) or host in _NO_RANGE_HOSTS:
+            continue
+        request = Request(url, headers={"Range": f"bytes=0-{nbytes - 1}"})
+        try:
+            with urlopen(request, timeout=_RANGE_TIMEOUT) as response:
+                if response.status != 206:
+                    _NO_RANGE_HOSTS.add(host)
+                    continue
+                raw = response.read(nbytes)
+            if name.endswith(".nii.gz"):
+                hdr = zlib.decompressobj(16 + zlib.MAX_WBITS).decompress(raw, 348)
+            else:
+                hdr = raw[:348]
+            return nifti_header_tr_seconds(hdr, url)
+        except HTTPError as e:
+            # A missing file says nothing about the host
+            if e.code != 404:
+                _NO_RANGE_HOSTS.add(host)
+            continue
+        except (OSError, http.client.HTTPException):
+            # URLError, refused connections, timeouts, truncated or malformed
+            # responses (IncompleteRead, BadStatusLine): skip the host
+            _NO_RANGE_HOSTS.add(host)
+            continue
+        except (ValueError, zlib.error):
+            continue
+    return None
+
+
 def parse_task_name(fname: str) -> Optional[str]:
     # Example: ..._task-rest_run-1_bold.nii.gz
-    for part in fname.split("_"):
-        if part.startswith("task-") and len(part) > 5:
-            return part[len("task-"):]
-    return None
+    return parse_bids_entity(fname, "task")
 
 
 def parse_bids_entity(fname: str, entity: str) -> Optional[str]:
@@ -146,22 +203,25 @@ def parse_bids_entity(fname: str, entity: str) -> Optional[str]:
     return None
 
 
-def is_bold_nifti(path: Path) -> bool:
-    name = path.name
-    return name.endswith("_bold.nii.gz") or name.endswith("_bold.nii")
+BOLD_NIFTI_SUFFIXES = ("_bold.nii.gz", "_bold.nii")
+T1W_NIFTI_SUFFIXES = ("_T1w.nii.gz", "_T1w.nii")
 
 
-def is_bold_json(path: Path) -> bool:
-    return path.name.endswith("_bold.json")
+def sidecar_kind(name: str) -> Optional[str]:
+    """Classify a BIDS file name for sidecar handling.
 
-
-def is_t1w_nifti(path: Path) -> bool:
-    name = path.name
-    return name.endswith("_T1w.nii.gz") or name.endswith("_T1w.nii")
-
-
-def is_t1w_json(path: Path) -> bool:
-    return path.name.endswith("_T1w.json")
+    Returns "bold", "bold_json", "t1w", "t1w_json", or None for anything else.
+    The suffixes are mutually exclusive, so one pass of tests is enough.
+    """
+    if name.endswith(BOLD_NIFTI_SUFFIXES):
+        return "bold"
+    if name.endswith("_bold.json"):
+        return "bold_json"
+    if name.endswith(T1W_NIFTI_SUFFIXES):
+        return "t1w"
+    if name.endswith("_T1w.json"):
+        return "t1w_json"
+    return None
 
 
 def sidecar_json_path(nifti_path: Path) -> Path:
@@ -173,107 +233,218 @@ def sidecar_json_path(nifti_path: Path) -> Path:
     raise ValueError(f"Not a NIfTI file: {nifti_path}")
 
 
-def map_abide1_relpath(relpath: Path, orig_id: str, new_id: str) -> Path:
-    rel_str = str(relpath).replace(f"sub-{orig_id}", f"sub-{new_id}")
-    rel_str = os.path.join("ses-1", rel_str)
-    dest_rel = Path(rel_str)
-
-    filename = dest_rel.name
-    if filename.startswith(f"sub-{new_id}") and "_ses-" not in filename:
-        rest = filename[len(f"sub-{new_id}"):]
-        filename = f"sub-{new_id}_ses-1{rest}"
-        dest_rel = dest_rel.with_name(filename)
-    return dest_rel
+def map_abide1_relpath(relpath: str, orig_sub: str, new_sub: str) -> str:
+    # Plain '/'-joined strings in and out: the caller builds one Path per file.
+    # Subject labels come in whole ("sub-<id>"), formatted once per subject.
+    head, _, filename = relpath.replace(orig_sub, new_sub).rpartition("/")
+    if filename.startswith(new_sub) and "_ses-" not in filename:
+        filename = f"{new_sub}_ses-1{filename[len(new_sub):]}"
+    return f"ses-1/{head}/{filename}" if head else f"ses-1/{filename}"
 
 
-def map_abide2_relpath(relpath: Path, orig_id: str, new_id: str) -> Path:
-    rel_str = str(relpath).replace(f"sub-{orig_id}", f"sub-{new_id}")
-    return Path(rel_str)
+def map_abide2_relpath(relpath: str, orig_sub: str, new_sub: str) -> str:
+    return relpath.replace(orig_sub, new_sub)
 
 
-def annex_whereis_key_urls(repo_dir: Path, relpath: Path, dry_run: bool) -> Tuple[str, List[str]]:
-    """Return (key, urls) for a file tracked in a git-annex repo."""
-    cmd = ["git", "annex", "whereis", "--json", str(relpath)]
-    out = run_cmd(cmd, cwd=repo_dir, capture_stdout=True, dry_run=dry_run)
-    if dry_run:
-        return ("<KEY>", ["<URL>"])
-    data = json.loads(out.strip().splitlines()[-1])
+def parse_whereis_record(repo_dir: Path, relpath: Union[str, Path], line: str) -> Tuple[str, List[str]]:
+    """Return (key, urls) from one ``git annex whereis --json`` output line."""
+    data = json.loads(line) if line.strip() else {}
     key = data.get("key")
     if not isinstance(key, str) or not key:
         raise RuntimeError(f"Could not determine annex key for {repo_dir}/{relpath}")
 
-    urls: List[str] = []
-    for entry in data.get("whereis", []) or []:
-        for url in entry.get("urls", []) or []:
-            if isinstance(url, str) and url:
-                urls.append(url)
-
     # Stable order, no duplicates
-    seen = set()
-    uniq = []
-    for u in urls:
-        if u in seen:
-            continue
-        seen.add(u)
-        uniq.append(u)
-    return key, uniq
+    urls = dict.fromkeys(
+        url
+        for entry in data.get("whereis", []) or []
+        for url in entry.get("urls", []) or []
+        if isinstance(url, str) and url
+    )
+    return key, list(urls)
 
 
-def annex_fromkey(dest_repo_dir: Path, key: str, dest_relpath: Path, dry_run: bool) -> None:
-    dest_abs = dest_repo_dir / dest_relpath
-    if os.path.lexists(dest_abs):
-        # If it's already the same key, keep; otherwise refuse to overwrite.
-        cmd = ["git", "annex", "lookupkey", str(dest_relpath)]
-        out = run_cmd(cmd, cwd=dest_repo_dir, capture_stdout=True, dry_run=dry_run).strip()
-        if dry_run:
-            return
-        if out == key:
-            return
-        raise RuntimeError(f"Destination exists with different key: {dest_abs} (have {out}, want {key})")
+def annex_whereis_batch(repo_dir: Path, relpaths: List[str]) -> List[Tuple[str, List[str]]]:
+    """Return (key, urls) for each file tracked in a git-annex repo.
 
-    if dry_run:
-        run_cmd(["git", "annex", "fromkey", "--force", key, str(dest_relpath)], cwd=dest_repo_dir, dry_run=True)
-        return
+    One ``git annex whereis --batch --json`` process answers all ``relpaths``
+    (git-annex startup dominates a per-file call). Results are in input order.
+    """
+    if not relpaths:
+        return []
+    res = subprocess.run(
+        ["git", "annex", "whereis", "--batch", "--json"],
+        cwd=str(repo_dir),
+        check=True,
+        input="".join(f"{p}\n" for p in relpaths),
+        stdout=subprocess.PIPE,
+        stderr=None,
+        text=True,
+    )
+    # Batch mode answers every input line, with a blank line for files it
+    # cannot handle (e.g., not annexed)
+    lines = res.stdout.splitlines()
+    if len(lines) != len(relpaths):
+        raise RuntimeError(
+            f"git-annex whereis returned {len(lines)} records for {len(relpaths)} paths in {repo_dir}"
+        )
+    return [parse_whereis_record(repo_dir, p, line) for p, line in zip(relpaths, lines)]
+
+
+class AnnexSession:
+    """Long-lived ``git annex <command> --batch --json`` processes on one repo.
+
+    Source files are fetched, inspected and dropped one at a time (site
+    templates, per-file JSON, BOLD headers), so each call used to pay a full
+    git-annex startup. A session starts one batch process per command on first
+    use and feeds it one path per request; use as a context manager to stop
+    them.
+    """
 
-    dest_abs.parent.mkdir(parents=True, exist_ok=True)
+    def __init__(self, repo_dir: Path, *, force_drop: bool = False):
+        self.repo_dir = repo_dir
+        self.force_drop = force_drop
+        self._procs: Dict[str, subprocess.Popen] = {}
+
+    def _request(self, command: str, relpath: Path) -> str:
+        proc = self._procs.get(command)
+        if proc is None:
+            cmd = ["git", "annex", command, "--batch", "--json"]
+            if command == "drop" and self.force_drop:
+                cmd.append("--force")
+            proc = subprocess.Popen(
+                cmd,
+                cwd=str(self.repo_dir),
+                stdin=subprocess.PIPE,
+                stdout=subprocess.PIPE,
+                text=True,
+                bufsize=1,
+            )
+            self._procs[command] = proc
+        proc.stdin.write(f"{relpath}\n")
+        proc.stdin.flush()
+        # Batch mode answers every input line (blank when nothing was done)
+        line = proc.stdout.readline()
+        if not line:
+            raise RuntimeError(f"git-annex {command} exited early in {self.repo_dir}")
+        return line
+
+    def _record(self, command: str, relpath: Path) -> Dict[str, Any]:
+        line = self._request(command, relpath)
+        return json.loads(line) if line.strip() else {}
+
+    def whereis(self, relpath: Path) -> Tuple[str, List[str]]:
+        return parse_whereis_record(self.repo_dir, relpath, self._request("whereis", relpath))
+
+    def get(self, relpath: Path) -> None:
+        if self._record("get", relpath).get("success") is False:
+            raise RuntimeError(f"git-annex get failed for {self.repo_dir}/{relpath}")
+
+    def drop(self, relpath: Path) -> None:
+        # Drop is a best-effort cleanup: if it fails (e.g., no known copies),
+        # keep the file rather than failing the whole build.
+        if self._record("drop", relpath).get("success") is False:
+            print(f"[WARN] git-annex drop failed for {self.repo_dir}/{relpath}")
+
+    def close(self) -> None:
+        for proc in self._procs.values():
+            proc.stdin.close()
+            proc.wait()
+        self._procs.clear()
+
+    def __enter__(self) -> "AnnexSession":
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
+
+
+def annex_fromkey_batch(dest_repo_dir: Path, pairs: List[Tuple[str, str]]) -> None:
+    """Create annex pointers from (key, dest_relpath) pairs with one ``fromkey --batch``.
+
+    Callers only pass destinations that do not exist yet.
+    """
+    if not pairs:
+        return
+    for parent in {(dest_repo_dir / dest_relpath).parent for _, dest_relpath in pairs}:
+        parent.mkdir(parents=True, exist_ok=True)
     # Newer git-annex versions can sanity-check keys against the current backend
     # and refuse to add "foreign" keys without --force. Since we are reusing keys
     # reported by the source datasets, override the check.
-    run_cmd(["git", "annex", "fromkey", "--force", key, str(dest_relpath)], cwd=dest_repo_dir, dry_run=False)
+    subprocess.run(
+        ["git", "annex", "fromkey", "--force", "--batch"],
+        cwd=str(dest_repo_dir),
+        check=True,
+        input="".join(f"{key} {dest_relpath}\n" for key, dest_relpath in pairs),
+        stdout=subprocess.DEVNULL,
+        text=True,
+    )
 
 
-def annex_registerurls(dest_repo_dir: Path, key: str, urls: List[str], dry_run: bool) -> None:
-    if not urls:
-        print(f"[WARN] No URLs found for key {key}; file may not be retrievable via 'web' remote.")
+def annex_registerurls_batch(dest_repo_dir: Path, key_urls: List[Tuple[str, List[str]]]) -> None:
+    """Register every (key, urls) pair on the 'web' remote with one ``registerurl --batch``."""
+    lines = []
+    for key, urls in key_urls:
+        if not urls:
+            print(f"[WARN] No URLs found for key {key}; file may not be retrievable via 'web' remote.")
+        lines.extend(f"{key} {url}\n" for url in urls)
+    if not lines:
         return
-    for url in urls:
-        run_cmd(
-            ["git", "annex", "registerurl", "--remote", "web", key, url],
-            cwd=dest_repo_dir,
-            dry_run=dry_run,
-        )
+    subprocess.run(
+        ["git", "annex", "registerurl", "--remote", "web", "--batch"],
+        cwd=str(dest_repo_dir),
+        check=True,
+        input="".join(lines),
+        stdout=subprocess.DEVNULL,
+        text=True,
+    )
 
 
-def iter_source_files(subject_dir: Path) -> Iterable[Path]:
-    for root, dirs, files in os.walk(subject_dir):
-        dirs[:] = [
-            d for d in dirs
-            if not d.startswith(".") and d not in {".git", ".datalad"}
-        ]
-        dirs.sort()
-        files.sort()
-        for fname in files:
-            if fname.startswith("."):
-                continue
-            yield Path(root) / fname
+def list_dir_entries(dir_path: Path) -> Dict[str, bool]:
+    """Map a directory's entry names to whether they are real directories.
+
+    Empty if the directory does not exist. The type comes from the directory
+    listing itself; symlinks (annex pointers) are not followed.
+    """
+    try:
+        with os.scandir(dir_path) as it:
+            return {entry.name: entry.is_dir(follow_symlinks=False) for entry in it}
+    except OSError:
+        return {}
+
+
+def iter_source_files(subject_dir: Path, rel: str = "") -> Iterable[str]:
+    """Yield the files under ``subject_dir`` as '/'-joined relative paths.
+
+    One scandir per directory. Annexed files are symlinks, so classify entries
+    without following them (no stat of the annex object per file). Same order
+    as a top-down os.walk: a directory's files, then its subdirs. Paths stay
+    strings here; the caller builds the few Path objects it needs.
+    """
+    files = []
+    dirs = []
+    try:
+        with os.scandir(subject_dir / rel if rel else subject_dir) as it:
+            for entry in it:
+                if entry.name.startswith("."):
+                    continue
+                if entry.is_dir(follow_symlinks=False):
+                    dirs.append(entry.name)
+                else:
+                    files.append(entry.name)
+    except OSError:
+        return
+    for fname in sorted(files):
+        yield f"{rel}{fname}"
+    for dname in sorted(dirs):
+        yield from iter_source_files(subject_dir, f"{rel}{dname}/")
 
 
 def load_site_template_json(
     src_repo_dir: Path,
     template_name: str,
     *,
+    annex: AnnexSession,
     dry_run: bool,
-    force_drop: bool,
     site_template_cache: Dict[Tuple[Path, str], Dict[str, Any]],
 ) -> Dict[str, Any]:
     """Load a site-level JSON template from a source dataset (best-effort).
@@ -298,18 +469,92 @@ def load_site_template_json(
             print(f"[DRYRUN] would git-annex get {src_repo_dir}/{template_name} (site template)")
         else:
             try:
-                annex_get(src_repo_dir, Path(template_name), dry_run=False)
+                annex.get(Path(template_name))
                 loaded = json.loads(template_path.read_text(encoding="utf-8"))
                 if isinstance(loaded, dict):
                     meta = loaded
             except Exception:
                 meta = {}
-            annex_drop(src_repo_dir, Path(template_name), dry_run=False, force=force_drop)
+            annex.drop(Path(template_name))
 
     site_template_cache[cache_key] = dict(meta)
     return dict(meta)
 
 
+def git_output(repo_dir: Path, *args: str) -> Optional[str]:
+    """Return the stripped stdout of ``git <args>`` in ``repo_dir`` (None on failure)."""
+    res = subprocess.run(
+        ["git", *args],
+        cwd=str(repo_dir),
+        check=False,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.DEVNULL,
+        text=True,
+    )
+    if res.returncode != 0:
+        return None
+    return res.stdout.strip() or None
+
+
+def read_template_cache(cache_path: Path, head: str) -> Dict[str, Dict[str, Any]]:
+    """Return templates persisted for a source site at commit ``head`` (empty if stale)."""
+    try:
+        cached = json.loads(cache_path.read_text(encoding="utf-8"))
+    except (OSError, ValueError):
+        return {}
+    if not isinstance(cached, dict) or cached.get("head") != head:
+        return {}
+    templates = cached.get("templates")
+    return templates if isinstance(templates, dict) else {}
+
+
+def atomic_write_bytes(path: Path, data: bytes) -> None:
+    """Write ``data`` to a temporary sibling, then rename it over ``path``.
+
+    Readers never see a half-written file, and an existing annex pointer at
+    ``path`` is replaced rather than written through. No fsync: these are
+    regenerable build outputs.
+    """
+    tmp = path.with_name(f".{os.getpid()}_{path.name}")
+    try:
+        tmp.write_bytes(data)
+    except FileNotFoundError:
+        # Only a missing parent needs the mkdir walk; most writes land in
+        # directories that already exist.
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp.write_bytes(data)
+    os.replace(tmp, path)
+
+
+def write_template_cache(cache_path: Path, head: str, templates: Dict[str, Dict[str, Any]]) -> None:
+    """Persist a source site's parsed templates, keyed by its commit (best-effort)."""
+    data = json.dumps({"head": head, "templates": templates}, indent=2, sort_keys=True) + "\n"
+    try:
+        atomic_write_bytes(cache_path, data.encode("utf-8"))
+    except OSError as e:
+        print(f"[WARN] Could not write template cache {cache_path}: {e}")
+
+
+def write_if_changed(path: Path, data: bytes) -> bool:
+    """Write an encoded payload to ``path`` unless the file already holds it.
+
+    Comparing against the existing bytes means re-runs over unchanged files
+    neither rewrite them nor touch their mtimes. Returns True if written.
+    """
+    try:
+        if path.stat().st_size == len(data) and path.read_bytes() == data:
+            return False
+    except OSError:
+        pass
+    atomic_write_bytes(path, data)
+    return True
+
+
+def write_json_sidecar(path: Path, meta: Dict[str, Any]) -> bool:
+    """Write ``meta`` as sorted, indented JSON; skip if the file already matches."""
+    return write_if_changed(path, (json.dumps(meta, indent=2, sort_keys=True) + "\n").encode("utf-8"))
+
+
 def ensure_bold_sidecar(
     src_repo_dir: Path,
     src_bold_rel: Path,
@@ -317,8 +562,8 @@ def ensure_bold_sidecar(
     dest_bold_rel: Path,
     dataset_name: str,
     site: str,
+    annex: AnnexSession,
     dry_run: bool,
-    force_drop: bool,
     overwrite: bool,
     ensure_tr: bool,
     site_template_cache: Dict[Tuple[Path, str], Dict[str, Any]],
@@ -352,8 +597,8 @@ def ensure_bold_sidecar(
             load_site_template_json(
                 src_repo_dir,
                 f"task-{task}_bold.json",
+                annex=annex,
                 dry_run=dry_run,
-                force_drop=force_drop,
                 site_template_cache=site_template_cache,
             )
         )
@@ -362,8 +607,8 @@ def ensure_bold_sidecar(
             load_site_template_json(
                 src_repo_dir,
                 f"task-{task}_acq-{acq}_bold.json",
+                annex=annex,
                 dry_run=dry_run,
-                force_drop=force_drop,
                 site_template_cache=site_template_cache,
             )
         )
@@ -373,8 +618,8 @@ def ensure_bold_sidecar(
             load_site_template_json(
                 src_repo_dir,
                 f"acq-{acq}_bold.json",
+                annex=annex,
                 dry_run=dry_run,
-                force_drop=force_drop,
                 site_template_cache=site_template_cache,
             )
         )
@@ -385,13 +630,13 @@ def ensure_bold_sidecar(
             print(f"[DRYRUN] would git-annex get {src_repo_dir}/{src_json_rel} (per-file JSON)")
         else:
             try:
-                annex_get(src_repo_dir, src_json_rel, dry_run=False)
+                annex.get(src_json_rel)
                 loaded = json.loads(src_json_abs.read_text(encoding="utf-8"))
                 if isinstance(loaded, dict):
                     src_meta = loaded
             except Exception:
                 src_meta = {}
-            annex_drop(src_repo_dir, src_json_rel, dry_run=False, force=force_drop)
+            annex.drop(src_json_rel)
 
     # Prefer an existing RepetitionTime in source JSON (if present and numeric).
     tr_sec: Optional[float] = None
@@ -400,6 +645,16 @@ def ensure_bold_sidecar(
         if isinstance(rt, (int, float)) and rt > 0:
             tr_sec = float(rt)
 
+    if tr_sec is None and ensure_tr and not dry_run:
+        # Try the header bytes alone from the source URL(s) first.
+        # Best effort only: any failure falls through to the annex get below.
+        try:
+            urls = annex.whereis(src_bold_rel)[1]
+            tr_sec = remote_nifti_tr_seconds(urls, src_bold_rel.name)
+        except Exception as e:
+            print(f"[WARN] Could not read TR remotely for {src_repo_dir}/{src_bold_rel}: {e}")
+            tr_sec = None
+
     if tr_sec is None and ensure_tr:
         # Extract TR from the NIfTI header (requires file content).
         if dry_run:
@@ -408,12 +663,12 @@ def ensure_bold_sidecar(
             print(f"[DRYRUN] would drop {src_repo_dir}/{src_bold_rel}")
         else:
             try:
-                annex_get(src_repo_dir, src_bold_rel, dry_run=False)
+                annex.get(src_bold_rel)
                 tr_sec = nifti_tr_seconds(src_bold_abs)
             except Exception as e:
                 print(f"[WARN] Could not extract TR for {src_repo_dir}/{src_bold_rel}: {e}")
             finally:
-                annex_drop(src_repo_dir, src_bold_rel, dry_run=False, force=force_drop)
+                annex.drop(src_bold_rel)
 
     meta: Dict[str, Any] = dict(template_meta)
     meta.update(src_meta)
@@ -426,8 +681,7 @@ def ensure_bold_sidecar(
         print(f"[DRYRUN] write {dest_json} <- keys={sorted(meta.keys())}")
         return
 
-    dest_json.parent.mkdir(parents=True, exist_ok=True)
-    dest_json.write_text(json.dumps(meta, indent=2, sort_keys=True) + "\n", encoding="utf-8")
+    write_json_sidecar(dest_json, meta)
 
 
 def ensure_t1w_sidecar(
@@ -437,8 +691,8 @@ def ensure_t1w_sidecar(
     dest_t1w_rel: Path,
     dataset_name: str,
     site: str,
+    annex: AnnexSession,
     dry_run: bool,
-    force_drop: bool,
     overwrite: bool,
     site_template_cache: Dict[Tuple[Path, str], Dict[str, Any]],
 ) -> None:
@@ -457,8 +711,8 @@ def ensure_t1w_sidecar(
         load_site_template_json(
             src_repo_dir,
             "T1w.json",
+            annex=annex,
             dry_run=dry_run,
-            force_drop=force_drop,
             site_template_cache=site_template_cache,
         )
     )
@@ -467,8 +721,8 @@ def ensure_t1w_sidecar(
             load_site_template_json(
                 src_repo_dir,
                 f"acq-{acq}_T1w.json",
+                annex=annex,
                 dry_run=dry_run,
-                force_drop=force_drop,
                 site_template_cache=site_template_cache,
             )
         )
@@ -481,13 +735,13 @@ def ensure_t1w_sidecar(
             print(f"[DRYRUN] would git-annex get {src_repo_dir}/{src_json_rel} (per-file JSON)")
         else:
             try:
-                annex_get(src_repo_dir, src_json_rel, dry_run=False)
+                annex.get(src_json_rel)
                 loaded = json.loads(src_json_abs.read_text(encoding="utf-8"))
                 if isinstance(loaded, dict):
                     src_meta = loaded
             except Exception:
                 src_meta = {}
-            annex_drop(src_repo_dir, src_json_rel, dry_run=False, force=force_drop)
+            annex.drop(src_json_rel)
 
     meta: Dict[str, Any] = dict(template_meta)
     meta.update(src_meta)
@@ -500,8 +754,13 @@ def ensure_t1w_sidecar(
         print(f"[WARN] No T1w metadata available for {src_repo_dir}/{src_t1w_rel}; not writing {dest_json}")
         return
 
-    dest_json.parent.mkdir(parents=True, exist_ok=True)
-    dest_json.write_text(json.dumps(meta, indent=2, sort_keys=True) + "\n", encoding="utf-8")
+    write_json_sidecar(dest_json, meta)
+
+
+# Phenotypic codes shared by ABIDE I and ABIDE II participants.tsv files.
+DX_MAP = {"1": "ASD", "2": "TC"}
+SEX_MAP = {"1": "M", "2": "F"}
+PHENO_MISSING = frozenset(("n/a", "-9999", ""))
 
 
 def read_site_phenotypic(
@@ -522,12 +781,12 @@ def read_site_phenotypic(
     except (OSError, UnicodeDecodeError):
         return {}
 
-    lines = text.strip().split("\n")
-    if len(lines) < 2:
+    rows = csv.reader(text.strip().splitlines(), delimiter="\t", quoting=csv.QUOTE_NONE)
+    raw_headers = next(rows, None)
+    if raw_headers is None:
         return {}
 
     # Case-insensitive header lookup (ABIDE I = UPPERCASE, ABIDE II = lowercase)
-    raw_headers = lines[0].split("\t")
     headers = [h.strip().lower() for h in raw_headers]
 
     col_map = {}
@@ -538,29 +797,27 @@ def read_site_phenotypic(
         except ValueError:
             return {}  # missing required column
 
-    DX_MAP = {"1": "ASD", "2": "TC"}
-    SEX_MAP = {"1": "M", "2": "F"}
-
     result = {}
-    for line in lines[1:]:
-        cols = line.split("\t")
-        raw_id = cols[col_map["participant_id"]].strip().replace("sub-", "")
+    for cols in rows:
+        if not cols:
+            continue
+        raw_id = cols[col_map["participant_id"]].strip().removeprefix("sub-")
 
         dx_raw = cols[col_map["dx_group"]].strip()
         group = DX_MAP.get(dx_raw, "n/a")
 
         age_raw = cols[col_map["age_at_scan"]].strip()
-        age = age_raw if age_raw not in ("n/a", "-9999", "") else "n/a"
+        age = age_raw if age_raw not in PHENO_MISSING else "n/a"
 
         sex_raw = cols[col_map["sex"]].strip()
         sex = SEX_MAP.get(sex_raw, "n/a")
 
         hand = cols[col_map["handedness_category"]].strip()
-        if hand in ("n/a", "-9999", ""):
+        if hand in PHENO_MISSING:
             hand = "n/a"
 
         fiq_raw = cols[col_map["fiq"]].strip()
-        fiq = fiq_raw if fiq_raw not in ("n/a", "-9999", "") else "n/a"
+        fiq = fiq_raw if fiq_raw not in PHENO_MISSING else "n/a"
 
         values = (group, age, sex, hand, fiq)
         result[raw_id] = values
@@ -573,115 +830,214 @@ def read_site_phenotypic(
     return result
 
 
-def build_abide(
-    project_root: Path,
+def scan_site(
+    site_dir: Path,
+    site_idx: int,
     out_dir: Path,
     dataset_name: str,
     version_tag: str,
     dry_run: bool,
-    participants: List[Tuple[str, str, str, int, str, str, str, str, str, str]],
     create_sidecars: bool,
     ensure_tr: bool,
     force_drop: bool,
     overwrite_sidecars: bool,
     sidecar_participant_ids: Optional[set],
-) -> int:
-    dataset_dir = project_root / "inputs" / dataset_name
-    if not dataset_dir.exists():
-        raise FileNotFoundError(f"Missing dataset directory: {dataset_dir}")
-
-    sites = list_sites(dataset_dir)
-    site_index = {site: idx for idx, site in enumerate(sites)}
-    created_files = 0
-    skipped_files = 0
+    template_cache_dir: Optional[Path] = None,
+) -> Tuple[List[Tuple[str, str, str, int, str, str, str, str, str, str]], List[Tuple[str, str]], int, int]:
+    """Map one source site into the merged view, short of creating annex pointers.
+
+    Writes the generated sidecars and returns ``(participants, pending, created,
+    skipped)``, where ``pending`` lists the (source relpath in site, destination
+    relpath) pairs that still need a pointer. Sites are independent source
+    repositories, so several can be scanned in parallel; pointer creation stays
+    in the caller, the only process touching the merged dataset's annex.
+
+    If ``template_cache_dir`` is given, parsed site templates are persisted
+    there per site and reused while the source repository's HEAD is unchanged,
+    so incremental builds skip their ``annex get``/``annex drop``.
+    """
+    site = site_dir.name
+    pheno = read_site_phenotypic(site_dir)
+    subjects = list_subjects(site_dir)
+    participants: List[Tuple[str, str, str, int, str, str, str, str, str, str]] = []
+    pending: List[Tuple[str, str]] = []
+    created = 0
+    skipped = 0
+    # Templates live in the site root, so a per-site cache loses nothing
+    cache_path = None
+    persisted: Dict[str, Dict[str, Any]] = {}
+    head = git_output(site_dir, "rev-parse", "HEAD") if template_cache_dir else None
+    if head:
+        cache_path = template_cache_dir / f"{dataset_name}_{site}.json"
+        persisted = read_template_cache(cache_path, head)
+    site_template_cache: Dict[Tuple[Path, str], Dict[str, Any]] = {
+        (site_dir, name): meta for name, meta in persisted.items()
+    }
 
-    site_template_cache: Dict[Tuple[Path, str], Dict[str, Any]] = {}
+    map_relpath = map_abide1_relpath if dataset_name == "abide1" else map_abide2_relpath
 
-    for site in sites:
-        site_dir = dataset_dir / site
-        pheno = read_site_phenotypic(site_dir)
-        subjects = list_subjects(site_dir)
+    # Sidecars fetch and drop source files one at a time; share one batch
+    # process per git-annex command for the whole site
+    with AnnexSession(site_dir, force_drop=force_drop) as annex:
         for subject_dir in subjects:
             orig_id = subject_dir.name[len("sub-"):]
             # NOTE: BIDS participant labels must be strictly alphanumeric.
             # We encode provenance info (ABIDE version + site index + original ID)
             # using only letters/digits: v1s0x0050642, v2s3x29006, ...
-            new_id = f"{version_tag}s{site_index[site]}x{orig_id}"
+            new_id = f"{version_tag}s{site_idx}x{orig_id}"
             participant_id = f"sub-{new_id}"
             do_sidecars = create_sidecars and (
                 not sidecar_participant_ids or participant_id in sidecar_participant_ids
             )
+            dest_listings: Dict[str, Dict[str, bool]] = {}
 
             group, age, sex, hand, fiq = pheno.get(orig_id, ("n/a",) * 5)
             participants.append(
-                (participant_id, dataset_name, site, site_index[site], orig_id,
+                (participant_id, dataset_name, site, site_idx, orig_id,
                  group, age, sex, hand, fiq)
             )
 
-            for src in iter_source_files(subject_dir):
-                relpath = src.relative_to(subject_dir)
-
-                if dataset_name == "abide1":
-                    dest_rel = map_abide1_relpath(relpath, orig_id, new_id)
-                else:
-                    dest_rel = map_abide2_relpath(relpath, orig_id, new_id)
-
-                dest_repo_rel = Path(participant_id) / dest_rel
+            # Per-file paths stay '/'-joined strings relative to their repo;
+            # Path objects are only built for the few files that get sidecars.
+            orig_sub = subject_dir.name
+            for rel in iter_source_files(subject_dir):
+                src_rel = f"{orig_sub}/{rel}"
+                dest_repo_rel = f"{participant_id}/{map_relpath(rel, orig_sub, participant_id)}"
 
                 # If we are generating sidecars, skip copying/adding any source
                 # per-file BOLD/T1w sidecars. We'll generate a new JSON in the
                 # merged dataset (and keep it in Git).
-                if do_sidecars and is_bold_json(relpath):
-                    continue
-                if do_sidecars and is_t1w_json(relpath):
+                kind = sidecar_kind(rel.rpartition("/")[2]) if do_sidecars else None
+                if kind in ("bold_json", "t1w_json"):
                     continue
 
-                # Create an annex pointer in inputs/abide-both with the same key,
-                # and register the original URL(s) so 'datalad get' can retrieve it.
-                dest_abs = out_dir / dest_repo_rel
-                if os.path.lexists(dest_abs):
-                    if dest_abs.is_dir():
-                        raise RuntimeError(f"Destination exists and is a directory: {dest_abs}")
-                    skipped_files += 1
+                # Queue an annex pointer for this file; the caller creates them
+                # for the whole site. Existing destinations come from one
+                # listing per directory rather than an lstat per file.
+                dest_dir, _, dest_name = dest_repo_rel.rpartition("/")
+                dest_entries = dest_listings.get(dest_dir)
+                if dest_entries is None:
+                    dest_entries = dest_listings[dest_dir] = list_dir_entries(out_dir / dest_dir)
+                dest_is_dir = dest_entries.get(dest_name)
+                if dest_is_dir is not None:
+                    if dest_is_dir:
+                        raise RuntimeError(f"Destination exists and is a directory: {out_dir / dest_repo_rel}")
+                    skipped += 1
                 else:
                     if dry_run:
-                        print(f"[DRYRUN] add {out_dir.name}/{dest_repo_rel} <- {site_dir.name}/{subject_dir.name}/{relpath}")
+                        print(f"[DRYRUN] add {out_dir.name}/{dest_repo_rel} <- {site_dir.name}/{subject_dir.name}/{rel}")
                     else:
-                        src_rel_in_site = src.relative_to(site_dir)
-                        key, urls = annex_whereis_key_urls(site_dir, src_rel_in_site, dry_run=False)
-                        annex_fromkey(out_dir, key, dest_repo_rel, dry_run=False)
-                        annex_registerurls(out_dir, key, urls, dry_run=False)
-                    created_files += 1
+                        pending.append((src_rel, dest_repo_rel))
+                    created += 1
 
-                if do_sidecars and is_bold_nifti(relpath):
+                if kind == "bold":
                     ensure_bold_sidecar(
                         src_repo_dir=site_dir,
-                        src_bold_rel=src.relative_to(site_dir),
+                        src_bold_rel=Path(src_rel),
                         dest_repo_dir=out_dir,
-                        dest_bold_rel=dest_repo_rel,
+                        dest_bold_rel=Path(dest_repo_rel),
                         dataset_name=dataset_name,
                         site=site,
+                        annex=annex,
                         dry_run=dry_run,
-                        force_drop=force_drop,
                         overwrite=overwrite_sidecars,
                         ensure_tr=ensure_tr,
                         site_template_cache=site_template_cache,
                     )
 
-                if do_sidecars and is_t1w_nifti(relpath):
+                if kind == "t1w":
                     ensure_t1w_sidecar(
                         src_repo_dir=site_dir,
-                        src_t1w_rel=src.relative_to(site_dir),
+                        src_t1w_rel=Path(src_rel),
                         dest_repo_dir=out_dir,
-                        dest_t1w_rel=dest_repo_rel,
+                        dest_t1w_rel=Path(dest_repo_rel),
                         dataset_name=dataset_name,
                         site=site,
+                        annex=annex,
                         dry_run=dry_run,
-                        force_drop=force_drop,
                         overwrite=overwrite_sidecars,
                         site_template_cache=site_template_cache,
                     )
 
+    if cache_path is not None:
+        # Empty results are not persisted: they may be a transient get failure
+        templates = {name: meta for (_, name), meta in site_template_cache.items() if meta}
+        if templates != persisted:
+            write_template_cache(cache_path, head, templates)
+
+    return participants, pending, created, skipped
+
+
+def build_abide(
+    project_root: Path,
+    out_dir: Path,
+    dataset_name: str,
+    version_tag: str,
+    dry_run: bool,
+    participants: List[Tuple[str, str, str, int, str, str, str, str, str, str]],
+    create_sidecars: bool,
+    ensure_tr: bool,
+    force_drop: bool,
+    overwrite_sidecars: bool,
+    sidecar_participant_ids: Optional[set],
+    jobs: int = 1,
+) -> int:
+    dataset_dir = project_root / "inputs" / dataset_name
+    if not dataset_dir.exists():
+        raise FileNotFoundError(f"Missing dataset directory: {dataset_dir}")
+
+    sites = list_sites(dataset_dir)
+    created_files = 0
+    skipped_files = 0
+
+    # Parsed site templates persist in the merged dataset's git dir, which is
+    # private to this clone and never committed
+    template_cache_dir = None
+    if not dry_run:
+        git_dir = git_output(out_dir, "rev-parse", "--absolute-git-dir")
+        if git_dir:
+            template_cache_dir = Path(git_dir) / "abide-both" / "site-templates"
+
+    scan = partial(
+        scan_site,
+        out_dir=out_dir,
+        dataset_name=dataset_name,
+        version_tag=version_tag,
+        dry_run=dry_run,
+        create_sidecars=create_sidecars,
+        ensure_tr=ensure_tr,
+        force_drop=force_drop,
+        overwrite_sidecars=overwrite_sidecars,
+        sidecar_participant_ids=sidecar_participant_ids,
+        template_cache_dir=template_cache_dir,
+    )
+    site_dirs = [dataset_dir / site for site in sites]
+    site_indices = range(len(sites))
+
+    with ExitStack() as stack:
+        if jobs > 1:
+            # Forked workers flush inherited stdio buffers on exit; empty ours
+            # first so nothing is printed twice.
+            sys.stdout.flush()
+            pool = stack.enter_context(ProcessPoolExecutor(max_workers=jobs))
+            results = pool.map(scan, site_dirs, site_indices)
+        else:
+            results = map(scan, site_dirs, site_indices)
+
+        # Results arrive in site order, so participants keep a stable order
+        for site_dir, (rows, pending, created, skipped) in zip(site_dirs, results):
+            participants.extend(rows)
+            created_files += created
+            skipped_files += skipped
+
+            # Create annex pointers in inputs/abide-both with the same keys, and
+            # register the original URL(s) so 'datalad get' can retrieve them.
+            key_urls = annex_whereis_batch(site_dir, [src_rel for src_rel, _ in pending])
+            annex_fromkey_batch(
+                out_dir, [(key, dest_rel) for (key, _), (_, dest_rel) in zip(key_urls, pending)]
+            )
+            annex_registerurls_batch(out_dir, key_urls)
+
     print(
         f"[INFO] {dataset_name}: created {created_files} files, skipped {skipped_files} existing files."
     )
@@ -713,18 +1069,18 @@ def write_participants_tsv(
     participants: List[Tuple[str, str, str, int, str, str, str, str, str, str]],
     dry_run: bool,
 ) -> None:
-    header = [
-        "participant_id", "source_dataset", "source_site", "site_index",
-        "source_subject_id", "group", "age", "sex", "handedness", "fiq",
-    ]
-    rows = sorted(participants, key=lambda r: r[0])
-    lines = ["\t".join(header)]
-    for row in rows:
-        lines.append("\t".join([str(col) for col in row]))
-
-    if not dry_run:
-        out_dir.mkdir(parents=True, exist_ok=True)
-        (out_dir / "participants.tsv").write_text("\n".join(lines) + "\n", encoding="utf-8")
+    if dry_run:
+        return
+    header = (
+        "participant_id\tsource_dataset\tsource_site\tsite_index\t"
+        "source_subject_id\tgroup\tage\tsex\thandedness\tfiq\n"
+    )
+    # Each row is a fixed 10-tuple; format it in one pass, then encode once.
+    body = "".join(
+        "%s\t%s\t%s\t%s\t%s\t%s\t%s\t%s\t%s\t%s\n" % row
+        for row in sorted(participants, key=lambda r: r[0])
+    )
+    write_if_changed(out_dir / "participants.tsv", (header + body).encode("utf-8"))
 
 
 def write_participants_json(out_dir: Path, dry_run: bool) -> None:
@@ -749,10 +1105,7 @@ def write_participants_json(out_dir: Path, dry_run: bool) -> None:
         "fiq": {"Description": "Full-scale IQ"},
     }
     if not dry_run:
-        out_dir.mkdir(parents=True, exist_ok=True)
-        (out_dir / "participants.json").write_text(
-            json.dumps(data, indent=2) + "\n", encoding="utf-8"
-        )
+        write_if_changed(out_dir / "participants.json", (json.dumps(data, indent=2) + "\n").encode("utf-8"))
 
 
 def write_dataset_description(out_dir: Path, dry_run: bool) -> None:
@@ -765,11 +1118,7 @@ def write_dataset_description(out_dir: Path, dry_run: bool) -> None:
         ],
     }
     if not dry_run:
-        out_dir.mkdir(parents=True, exist_ok=True)
-        (out_dir / "dataset_description.json").write_text(
-            json.dumps(data, indent=2) + "\n",
-            encoding="utf-8",
-        )
+        write_if_changed(out_dir / "dataset_description.json", (json.dumps(data, indent=2) + "\n").encode("utf-8"))
 
 
 METADATA_PATTERNS = [
@@ -782,35 +1131,53 @@ METADATA_PATTERNS = [
     "*.csv",
 ]
 
+# One regex for all patterns; fnmatch.fnmatch would translate (or look up)
+# each pattern again for every listed path.
+_METADATA_RE = re.compile("|".join(fnmatch.translate(pat) for pat in METADATA_PATTERNS))
+
 
-def iter_metadata_candidate_relpaths(repo_dir: Path) -> List[Path]:
-    """Return repo-relative paths of potential BIDS metadata files.
+def iter_metadata_candidate_relpaths(repo_dir: Path) -> List[Tuple[Path, bool]]:
+    """Return (repo-relative path, is_symlink) for potential BIDS metadata files.
 
     The merged dataset uses git-annex keys for everything we add via `fromkey`.
     For small metadata files we want *content* in Git. This function identifies
-    those paths so they can be fetched and `unannex`ed.
+    those paths so they can be fetched and `unannex`ed; annexed ones are the
+    symlinks. The index already lists every tracked path with its mode, so one
+    `git ls-files --stage` replaces a walk of the working tree (120000 is the
+    symlink mode). Paths still in the index but gone from the working tree
+    (e.g., subject trees removed by --clean and not yet saved) are skipped.
     """
-    relpaths: List[Path] = []
-    for root, dirs, files in os.walk(repo_dir):
-        # Never touch internal dataset/metadata.
-        dirs[:] = [
-            d
-            for d in sorted(dirs)
-            if not d.startswith(".") and d not in {".git", ".datalad"}
-        ]
-        files.sort()
-        for fname in files:
-            if fname.startswith("."):
-                continue
-            if not any(fnmatch.fnmatch(fname, pat) for pat in METADATA_PATTERNS):
-                continue
-            abspath = Path(root) / fname
-            try:
-                relpaths.append(abspath.relative_to(repo_dir))
-            except ValueError:
-                # Should never happen, but keep the walk robust.
-                continue
-    return sorted(relpaths)
+    res = subprocess.run(
+        ["git", "ls-files", "-z", "--stage"],
+        cwd=str(repo_dir),
+        check=True,
+        stdout=subprocess.PIPE,
+    )
+    deleted = set(
+        subprocess.run(
+            ["git", "ls-files", "-z", "--deleted"],
+            cwd=str(repo_dir),
+            check=True,
+            stdout=subprocess.PIPE,
+        ).stdout.split(b"\0")
+    )
+    found: List[Tuple[Path, bool]] = []
+    for record in res.stdout.split(b"\0"):
+        if not record:
+            continue
+        # "<mode> <object> <stage>\t<path>"
+        info, _, raw = record.partition(b"\t")
+        if raw in deleted:
+            continue
+        relpath = os.fsdecode(raw)
+        dirname, _, name = relpath.rpartition("/")
+        # Never touch internal dataset/metadata (.git, .datalad, ...).
+        if name.startswith(".") or "/." in f"/{dirname}":
+            continue
+        if _METADATA_RE.match(name):
+            found.append((Path(relpath), info.startswith(b"120000 ")))
+    # Unmerged entries list a path once per stage
+    return sorted(set(found))
 
 
 def chunked(items: List[Path], n: int) -> Iterable[List[Path]]:
@@ -820,6 +1187,42 @@ def chunked(items: List[Path], n: int) -> Iterable[List[Path]]:
         yield items[i : i + n]
 
 
+def annex_key_size(key: Any) -> Optional[int]:
+    """Return the content size recorded in a git-annex key, if any.
+
+    Keys look like ``SHA256E-s1234--<hash>.json``; the ``s`` field is optional.
+    """
+    if not isinstance(key, str):
+        return None
+    for field in key.split("--", 1)[0].split("-")[1:]:
+        if field[:1] == "s" and field[1:].isdigit():
+            return int(field[1:])
+    return None
+
+
+def iter_prefetched(
+    fn: Callable[[Any], Any], items: Iterable[Any], *, serial: bool = False
+) -> Iterator[Tuple[Any, Any]]:
+    """Yield (item, fn(item)) in order, computing the next result in a thread.
+
+    While the caller works on one result, ``fn`` already runs on the next item,
+    so a slow network-bound step overlaps with local processing. With
+    ``serial=True`` everything runs in the caller's thread.
+    """
+    if serial:
+        for item in items:
+            yield item, fn(item)
+        return
+
+    items = list(items)
+    with ThreadPoolExecutor(max_workers=1) as pool:
+        futures = [pool.submit(fn, items[0])] if items else []
+        for i, item in enumerate(items):
+            if i + 1 < len(items):
+                futures.append(pool.submit(fn, items[i + 1]))
+            yield item, futures[i].result()
+
+
 def run_annex_json(
     cmd: List[str],
     cwd: Path,
@@ -868,8 +1271,9 @@ def materialize_metadata(
     report_path: Path,
 ) -> None:
     """Fetch candidate metadata and move it out of annex into Git."""
-    candidates = iter_metadata_candidate_relpaths(repo_dir)
-    annexed = [p for p in candidates if (repo_dir / p).is_symlink()]
+    scanned = iter_metadata_candidate_relpaths(repo_dir)
+    candidates = [p for p, _ in scanned]
+    annexed = [p for p, is_link in scanned if is_link]
     already_in_git = len(candidates) - len(annexed)
 
     # Best-effort report, always written (unless dry-run).
@@ -893,12 +1297,17 @@ def materialize_metadata(
     if not annexed:
         print("[INFO] No annexed metadata candidates found; nothing to materialize.")
         if not dry_run:
-            report_path.parent.mkdir(parents=True, exist_ok=True)
-            report_path.write_text(json.dumps(report, indent=2, sort_keys=True) + "\n", encoding="utf-8")
+            atomic_write_bytes(report_path, (json.dumps(report, indent=2, sort_keys=True) + "\n").encode("utf-8"))
         return
 
-    # Keep chunks modest; macOS has a relatively small max argv size.
-    for chunk in chunked(annexed, n=400):
+    # The next chunk's `get` is prefetched while this one is filtered, but git
+    # commands never overlap: `get` only writes objects and location-log
+    # entries to the annex journal, yet `unannex` rewrites the index and that
+    # same journal. Both hold this lock, so prefetching overlaps a `get` with
+    # the local stat/size filtering only, never with an `unannex`.
+    annex_lock = threading.Lock()
+
+    def get_chunk(chunk: List[Path]) -> Tuple[int, List[Dict[str, Any]], List[str], str]:
         # 1) Fetch metadata content (best-effort).
         cmd_get = [
             "git",
@@ -911,12 +1320,21 @@ def materialize_metadata(
             "--",
             *[str(p) for p in chunk],
         ]
-        rc, records, parse_errors, stderr = run_annex_json(cmd_get, cwd=repo_dir, dry_run=dry_run)
+        with annex_lock:
+            return run_annex_json(cmd_get, cwd=repo_dir, dry_run=dry_run)
+
+    # Keep chunks modest; macOS has a relatively small max argv size.
+    for chunk, (rc, records, parse_errors, stderr) in iter_prefetched(
+        get_chunk, chunked(annexed, n=400), serial=dry_run
+    ):
         report["parse_errors"].extend(parse_errors)
         if stderr.strip():
             report["stderr_snippets"].append(stderr.strip()[:4000])
 
         ok: set = set()
+        # Content sizes known without a stat: from the annex key, or from the
+        # presence check below.
+        sizes: Dict[Path, int] = {}
         for rec in records:
             f = rec.get("file")
             if not isinstance(f, str) or not f:
@@ -924,6 +1342,9 @@ def materialize_metadata(
             rel = Path(f.lstrip("./"))
             if rec.get("success") is True:
                 ok.add(rel)
+                key_size = annex_key_size(rec.get("key"))
+                if key_size is not None:
+                    sizes[rel] = key_size
             elif rec.get("success") is False:
                 report["get_failures"][str(rel)] = rec.get("error-messages") or rec.get("error-message") or ""
 
@@ -941,7 +1362,7 @@ def materialize_metadata(
                 if rel in ok or str(rel) in report["get_failures"]:
                     continue
                 try:
-                    (repo_dir / rel).stat()
+                    sizes[rel] = (repo_dir / rel).stat().st_size
                 except FileNotFoundError:
                     report["get_failures"].setdefault(
                         str(rel),
@@ -959,11 +1380,14 @@ def materialize_metadata(
             if dry_run:
                 to_unannex.append(rel)
                 continue
-            try:
-                size_mb = p.stat().st_size / (1024 * 1024)
-            except FileNotFoundError:
-                report["get_failures"].setdefault(str(rel), "content not present after successful get")
-                continue
+            size = sizes.get(rel)
+            if size is None:
+                try:
+                    size = p.stat().st_size
+                except FileNotFoundError:
+                    report["get_failures"].setdefault(str(rel), "content not present after successful get")
+                    continue
+            size_mb = size / (1024 * 1024)
 
             if size_mb > max_mb:
                 report["too_large_keep_annexed"].append(str(rel))
@@ -982,7 +1406,8 @@ def materialize_metadata(
             "--",
             *[str(p) for p in to_unannex],
         ]
-        rc2, records2, parse_errors2, stderr2 = run_annex_json(cmd_unannex, cwd=repo_dir, dry_run=dry_run)
+        with annex_lock:
+            rc2, records2, parse_errors2, stderr2 = run_annex_json(cmd_unannex, cwd=repo_dir, dry_run=dry_run)
         report["parse_errors"].extend(parse_errors2)
         if stderr2.strip():
             report["stderr_snippets"].append(stderr2.strip()[:4000])
@@ -1019,16 +1444,12 @@ def materialize_metadata(
 
         report["converted_to_git"].extend(sorted([str(p) for p in converted]))
 
-    # Recompute how many are still annexed.
+    # Every annexed candidate not verified as converted is still annexed;
+    # conversions were confirmed per file above, so no re-lstat is needed.
     if not dry_run:
-        still_annexed = 0
-        for p in candidates:
-            if (repo_dir / p).is_symlink():
-                still_annexed += 1
-        report["still_annexed_after"] = still_annexed
+        report["still_annexed_after"] = len(annexed) - len(report["converted_to_git"])
 
-        report_path.parent.mkdir(parents=True, exist_ok=True)
-        report_path.write_text(json.dumps(report, indent=2, sort_keys=True) + "\n", encoding="utf-8")
+        atomic_write_bytes(report_path, (json.dumps(report, indent=2, sort_keys=True) + "\n").encode("utf-8"))
 
     print(
         "[INFO] Metadata materialization: "
@@ -1104,6 +1525,12 @@ def parse_args() -> argparse.Namespace:
         help="Use safe 'git annex drop' checks (default: drop with --force to free space quickly).",
     )
     parser.set_defaults(force_drop=True)
+    parser.add_argument(
+        "--jobs",
+        type=int,
+        default=1,
+        help="Source sites scanned in parallel (sidecar generation included; default: 1).",
+    )
     parser.add_argument(
         "--datasets",
         default="abide1,abide2",
@@ -1141,6 +1568,10 @@ def parse_args() -> argparse.Namespace:
 
 def main() -> None:
     args = parse_args()
+    if args.dry_run:
+        # A dry run prints a line per planned action; block-buffer them rather
+        # than flushing every line to the terminal. Python flushes at exit.
+        sys.stdout.reconfigure(line_buffering=False)
     project_root = Path(args.project_root).resolve()
     out_dir = project_root / "inputs" / "abide-both"
     datasets = [d.strip() for d in args.datasets.split(",") if d.strip()]
@@ -1176,6 +1607,7 @@ def main() -> None:
                 force_drop=args.force_drop,
                 overwrite_sidecars=args.overwrite_sidecars,
                 sidecar_participant_ids=sidecar_participant_ids,
+                jobs=args.jobs,
             )
 
         if "abide2" in datasets:
@@ -1191,6 +1623,7 @@ def main() -> None:
                 force_drop=args.force_drop,
                 overwrite_sidecars=args.overwrite_sidecars,
                 sidecar_participant_ids=sidecar_participant_ids,
+                jobs=args.jobs,
             )
 
         write_participants_tsv(out_dir, participants, args.dry_run)
@@ -82,18 +82,28 @@ if op.lexists(attr_fpath):
 else:
     attrs = ''
 
+# current annex.largefiles setting per pattern; later lines win, as in git.
+# Matching whole patterns (not substrings) keeps e.g. 'sub/*.json' from
+# counting as '*.json'
+largefiles = {}
+for line in attrs.splitlines():
+    fields = line.split()
+    for field in fields[1:]:
+        if field.startswith('annex.largefiles='):
+            largefiles[fields[0]] = field.split('=', 1)[1]
+
 # amend gitattributes, if needed
 ds.repo.set_gitattributes([
     (path, {'annex.largefiles': 'nothing'})
     for path in force_in_git
-    if '{} annex.largefiles=nothing'.format(path) not in attrs
+    if largefiles.get(path) != 'nothing'
 ])
 
 # amend gitattributes, if needed
 ds.repo.set_gitattributes([
     (path, {'annex.largefiles': 'anything'})
     for path in force_in_annex
-    if '{} annex.largefiles=anything'.format(path) not in attrs
+    if largefiles.get(path) != 'anything'
 ])
 
 # leave clean
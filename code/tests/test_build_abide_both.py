@@ -0,0 +1,108 @@
+"""Tests for build_abide_both.py (standard library only).
+
+Run from the repository root with either runner:
+
+    python -m pytest code/tests
+    python -m unittest discover -s code/tests
+"""
+
+import http.client
+import sys
+import tempfile
+import threading
+import time
+import unittest
+from pathlib import Path
+from unittest import mock
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+import build_abide_both as bab  # noqa: E402
+
+
+class RemoteNiftiTrTest(unittest.TestCase):
+    def setUp(self):
+        bab._NO_RANGE_HOSTS.clear()
+
+    def tearDown(self):
+        bab._NO_RANGE_HOSTS.clear()
+
+    def test_incomplete_read_negative_caches_host(self):
+        urls = ["https://example.org/sub-01_bold.nii.gz"]
+        with mock.patch.object(
+            bab, "urlopen", side_effect=http.client.IncompleteRead(b"")
+        ) as urlopen:
+            self.assertIsNone(bab.remote_nifti_tr_seconds(urls, "sub-01_bold.nii.gz"))
+            self.assertIn("example.org", bab._NO_RANGE_HOSTS)
+            # A second file on the same host is not requested again
+            self.assertIsNone(bab.remote_nifti_tr_seconds(urls, "sub-01_bold.nii.gz"))
+        self.assertEqual(urlopen.call_count, 1)
+
+
+class IterPrefetchedTest(unittest.TestCase):
+    def test_threaded_results_in_order(self):
+        got = list(bab.iter_prefetched(lambda x: x * x, range(5)))
+        self.assertEqual(got, [(i, i * i) for i in range(5)])
+        self.assertEqual(list(bab.iter_prefetched(lambda x: x, [])), [])
+
+    def test_threaded_overlaps_next_item(self):
+        started = {i: threading.Event() for i in range(3)}
+
+        def fn(i):
+            started[i].set()
+            return i
+
+        for item, _ in bab.iter_prefetched(fn, range(3)):
+            if item + 1 < 3:
+                # fn(item + 1) runs while the caller still holds item
+                self.assertTrue(started[item + 1].wait(timeout=5))
+
+    def test_threaded_propagates_exception(self):
+        def fn(i):
+            if i == 1:
+                raise RuntimeError("boom")
+            return i
+
+        it = bab.iter_prefetched(fn, range(3))
+        self.assertEqual(next(it), (0, 0))
+        with self.assertRaisesRegex(RuntimeError, "boom"):
+            next(it)
+
+
+class MaterializeMetadataTest(unittest.TestCase):
+    def test_get_never_overlaps_unannex(self):
+        # Two chunks of 400, so the second get is prefetched during the first
+        # chunk's unannex.
+        relpaths = [Path(f"sub-{i:04d}/sub-{i:04d}_T1w.json") for i in range(401)]
+        active = []
+        overlaps = []
+        calls = []
+
+        def run_annex_json(cmd, cwd, *, dry_run):
+            active.append(cmd[2])
+            if len(active) > 1:
+                overlaps.append(list(active))
+            time.sleep(0.05)
+            files = cmd[cmd.index("--") + 1 :]
+            records = [
+                {"file": f, "success": True, "key": "SHA256E-s10--abc.json"} for f in files
+            ]
+            calls.append(cmd[2])
+            active.remove(cmd[2])
+            return 0, records, [], ""
+
+        with tempfile.TemporaryDirectory() as tmp, mock.patch.object(
+            bab, "iter_metadata_candidate_relpaths", return_value=[(p, True) for p in relpaths]
+        ), mock.patch.object(bab, "run_annex_json", side_effect=run_annex_json):
+            report_path = Path(tmp) / "report.json"
+            bab.materialize_metadata(
+                Path(tmp), dry_run=False, jobs=1, max_mb=1.0, report_path=report_path
+            )
+            self.assertTrue(report_path.exists())
+
+        self.assertEqual(overlaps, [])
+        self.assertEqual(sorted(calls), ["get", "get", "unannex", "unannex"])
+
+
+if __name__ == "__main__":
+    unittest.main()